@@ -0,0 +1,6 @@
+"""
+Headless, reproducible benchmarks for pyquadtree
+
+Run with python -m benchmarks, see python -m benchmarks --help
+Every workload is made from a seeded random.Random, so the same seed and size always give the same points and queries
+"""
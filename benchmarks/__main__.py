@@ -0,0 +1,87 @@
+"""
+python -m benchmarks [--engine E] [--size N] [--seed S] [--output results.json] [--baseline baseline.json]
+
+Runs every workload, prints the results, and writes them to a JSON file
+With --baseline, exits with status 1 if any operation is slower or uses more memory than in the baseline
+The baseline can be from another engine, e.g. to compare the linear quadtree against the QuadTree
+"""
+
+import argparse
+import inspect
+import json
+import platform
+import sys
+
+from .suite import ENGINES, OPERATIONS, compare, memory_per_point, run_workload
+from .workloads import WORKLOADS
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark pyquadtree")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="quadtree", help="The tree to benchmark")
+    parser.add_argument("--size", type=int, default=20000, help="The number of points in each workload")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the workloads")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each operation is run, the fastest is kept")
+    parser.add_argument("--max-elements", type=int, help="Defaults to the engine's own default")
+    parser.add_argument("--max-depth", type=int, default=10)
+    parser.add_argument("--workloads", nargs="+", choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="How much slower than the baseline counts as a regression, 0.1 is 10%%")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tree_class = ENGINES[args.engine]
+    if args.max_elements is None:
+        # The engines split nodes at very different costs, so each is run with the default it was tuned for
+        args.max_elements = inspect.signature(tree_class).parameters["max_elements"].default
+
+    results = {
+        "engine": args.engine,
+        "settings": {"size": args.size, "seed": args.seed, "repeat": args.repeat,
+                     "max_elements": args.max_elements, "max_depth": args.max_depth},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workloads": {},
+    }
+
+    print("| Workload | " + " | ".join(OPERATIONS) + " | Bytes per point |")
+    print("|---" * (len(OPERATIONS) + 2) + "|")
+    for name in args.workloads:
+        workload = WORKLOADS[name](args.size, args.seed)
+        operations = run_workload(workload, tree_class, max_elements=args.max_elements, max_depth=args.max_depth,
+                                  repeat=args.repeat)
+        memory = memory_per_point(workload, tree_class, max_elements=args.max_elements, max_depth=args.max_depth)
+        results["workloads"][name] = {"operations": operations, "memory_bytes_per_point": memory}
+
+        rates = [str(round(operations[operation]["ops_per_sec"] or 0)) for operation in OPERATIONS]
+        print("| " + name + " | " + " | ".join(rates) + " | " + str(round(memory, 1)) + " |")
+    print("Numbers are operations per second")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("settings") != results["settings"]:
+            print("Warning: the baseline was run with different settings " + str(baseline.get("settings")))
+        # Baselines from before there were engines are from the QuadTree
+        if baseline.get("engine", "quadtree") != args.engine:
+            print("Comparing " + args.engine + " against " + baseline.get("engine", "quadtree"))
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print("Regression in " + name + " " + metric + ": " + str(round(old, 1)) + " -> " + str(round(new, 1)))
+        if regressions:
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Timing the operations of a tree on a workload, measuring memory, and comparing results against a baseline
+"""
+
+import gc
+import tracemalloc
+from time import perf_counter
+
+from pyquadtree import LinearQuadTree, QuadTree
+
+from .workloads import BBOX
+
+OPERATIONS = ("build", "bulk_build", "query", "nearest_neighbors", "delete", "move")
+
+# The trees that can be benchmarked, by the name used on the command line
+ENGINES = {"quadtree": QuadTree, "linear": LinearQuadTree}
+
+
+def best_time(setup, run, repeat):
+    """
+    Time a function, keeping the fastest of a few runs
+    Garbage collection is turned off while timing, like timeit does
+    :param setup: Called before each run without being timed, its result is passed to run
+    :param run: The function to time
+    :param repeat: The number of runs
+    :return: The fastest time in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = perf_counter()
+            run(state)
+            best = min(best, perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+
+def build(tree_class, workload, max_elements, max_depth):
+    """
+    Build a tree by adding the workload's points one at a time
+    :return: The tree and the handle of each point
+    """
+    qtree = tree_class(BBOX, max_elements, max_depth)
+    handles = [qtree.add(i, point) for i, point in enumerate(workload.points)]
+    return qtree, handles
+
+
+def run_workload(workload, tree_class=QuadTree, max_elements=10, max_depth=10, repeat=3):
+    """
+    Time every operation on a workload
+    :param workload: The Workload
+    :param tree_class: The class of the tree, it needs the same methods as QuadTree
+    :param max_elements: The maximum number of points in a node before it splits
+    :param max_depth: The maximum number of levels in the tree
+    :param repeat: The number of times each operation is timed, the fastest is kept
+    :return: A dictionary from each operation to its number of operations, seconds, and operations per second
+    """
+    def built():
+        return build(tree_class, workload, max_elements, max_depth)
+
+    def run_deletes(state):
+        qtree, handles = state
+        for i in workload.deletes:
+            qtree.delete(handle=handles[i])
+
+    def run_moves(state):
+        qtree, handles = state
+        for i, point in workload.moves:
+            qtree.move(handle=handles[i], new_point=point)
+
+    qtree, _ = built()
+    timings = {
+        "build": (len(workload.points), best_time(lambda: None, lambda _: built(), repeat)),
+        "bulk_build": (len(workload.points), best_time(
+            lambda: None, lambda _: tree_class.from_points(workload.points, bbox=BBOX, max_elements=max_elements,
+                                                           max_depth=max_depth), repeat)),
+        "query": (len(workload.queries), best_time(
+            lambda: qtree, lambda tree: [tree.query(bbox) for bbox in workload.queries], repeat)),
+        "nearest_neighbors": (len(workload.knn_points), best_time(
+            lambda: qtree, lambda tree: [tree.nearest_neighbors(point, number_of_neighbors=5)
+                                         for point in workload.knn_points], repeat)),
+        "delete": (len(workload.deletes), best_time(built, run_deletes, repeat)),
+        "move": (len(workload.moves), best_time(built, run_moves, repeat)),
+    }
+    return {operation: {"ops": ops, "seconds": seconds, "ops_per_sec": ops / seconds if seconds else None}
+            for operation, (ops, seconds) in timings.items()}
+
+
+def memory_per_point(workload, tree_class=QuadTree, max_elements=10, max_depth=10):
+    """
+    The memory allocated while building a tree from a workload's points, per point
+    The points themselves aren't counted since they are made before tracing starts
+    :return: The number of bytes per point
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        qtree, handles = build(tree_class, workload, max_elements, max_depth)
+        memory_used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return memory_used / len(workload.points)
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Find the operations that got slower or use more memory than in a baseline
+    Only the workloads and operations in both are compared
+    :param results: The results from the benchmarks, see __main__
+    :param baseline: Earlier results in the same format
+    :param threshold: How much worse a number can be before it counts, 0.1 is 10%
+    :return: A list of (workload, metric, baseline value, new value) for every regression
+    """
+    regressions = []
+    for name, workload in results["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if old is None:
+            continue
+
+        for operation, timing in workload["operations"].items():
+            old_timing = old["operations"].get(operation)
+            if old_timing is None or not old_timing["ops_per_sec"] or not timing["ops_per_sec"]:
+                continue
+            if timing["ops_per_sec"] < old_timing["ops_per_sec"] * (1 - threshold):
+                regressions.append((name, operation + " ops/sec", old_timing["ops_per_sec"], timing["ops_per_sec"]))
+
+        old_memory = old.get("memory_bytes_per_point")
+        memory = workload.get("memory_bytes_per_point")
+        if old_memory and memory and memory > old_memory * (1 + threshold):
+            regressions.append((name, "memory bytes/point", old_memory, memory))
+    return regressions
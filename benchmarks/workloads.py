@@ -0,0 +1,128 @@
+"""
+The workloads the benchmarks are run on
+Each one is made from its own seeded random.Random, so it is the same on every run
+"""
+
+import random
+
+BBOX = (0, 0, 1000, 1000)
+
+
+class Workload:
+    def __init__(self, name, points, queries, knn_points, moves, deletes):
+        """
+        :param name: The name of the workload
+        :param points: The points the tree is built with, the item of each point is its index
+        :param queries: Bounding boxes to query
+        :param knn_points: Points to find the nearest neighbors of
+        :param moves: A list of (index, new point) to move the points to, in order
+        :param deletes: The indices of the points to delete, in order
+        """
+        self.name = name
+        self.points = points
+        self.queries = queries
+        self.knn_points = knn_points
+        self.moves = moves
+        self.deletes = deletes
+
+
+def random_queries(rng, count, max_size=100):
+    """
+    :param rng: The random.Random to use
+    :param count: The number of bounding boxes
+    :param max_size: The largest width and height of a bounding box
+    :return: A list of bounding boxes within BBOX
+    """
+    queries = []
+    for _ in range(count):
+        width = rng.uniform(0, max_size)
+        height = rng.uniform(0, max_size)
+        x = rng.uniform(BBOX[0], BBOX[2] - width)
+        y = rng.uniform(BBOX[1], BBOX[3] - height)
+        queries.append((x, y, x + width, y + height))
+    return queries
+
+
+def random_points(rng, count):
+    return [(rng.uniform(BBOX[0], BBOX[2]), rng.uniform(BBOX[1], BBOX[3])) for _ in range(count)]
+
+
+def clustered_points(rng, count, clusters=20, spread=15):
+    """
+    Points in gaussian clusters, kept within BBOX
+    :param rng: The random.Random to use
+    :param count: The number of points
+    :param clusters: The number of clusters
+    :param spread: The standard deviation of each cluster
+    :return: A list of points
+    """
+    centers = random_points(rng, clusters)
+    points = []
+    for _ in range(count):
+        cx, cy = rng.choice(centers)
+        x = min(max(rng.gauss(cx, spread), BBOX[0]), BBOX[2])
+        y = min(max(rng.gauss(cy, spread), BBOX[1]), BBOX[3])
+        points.append((x, y))
+    return points
+
+
+def uniform(size, seed):
+    rng = random.Random(seed)
+    points = random_points(rng, size)
+    return Workload("uniform", points, random_queries(rng, size // 10), random_points(rng, size // 10),
+                    list(zip(rng.sample(range(size), size // 10), random_points(rng, size // 10))),
+                    rng.sample(range(size), size // 10))
+
+
+def clustered(size, seed):
+    rng = random.Random(seed)
+    points = clustered_points(rng, size)
+    # The queries and nearest neighbor searches follow the data
+    knn_points = clustered_points(rng, size // 10)
+    queries = [(x - 25, y - 25, x + 25, y + 25) for x, y in clustered_points(rng, size // 10)]
+    return Workload("clustered", points, queries, knn_points,
+                    list(zip(rng.sample(range(size), size // 10), clustered_points(rng, size // 10))),
+                    rng.sample(range(size), size // 10))
+
+
+def moving_objects(size, seed, steps=5, speed=5):
+    """
+    Every object takes a few small steps in a random direction, like objects in a simulation
+    """
+    rng = random.Random(seed)
+    points = random_points(rng, size)
+    moves = []
+    current = list(points)
+    for _ in range(steps):
+        for i, (x, y) in enumerate(current):
+            current[i] = (min(max(x + rng.uniform(-speed, speed), BBOX[0]), BBOX[2]),
+                          min(max(y + rng.uniform(-speed, speed), BBOX[1]), BBOX[3]))
+            moves.append((i, current[i]))
+    return Workload("moving_objects", points, random_queries(rng, size // 10, 50), random_points(rng, size // 10),
+                    moves, rng.sample(range(size), size // 10))
+
+
+def delete_heavy(size, seed):
+    """
+    Most of the points are deleted, so the tree keeps merging nodes
+    """
+    rng = random.Random(seed)
+    points = random_points(rng, size)
+    return Workload("delete_heavy", points, random_queries(rng, size // 10), random_points(rng, size // 10),
+                    list(zip(rng.sample(range(size), size // 10), random_points(rng, size // 10))),
+                    rng.sample(range(size), size * 9 // 10))
+
+
+def large_queries(size, seed):
+    """
+    Queries up to a third of the bbox wide, each one finds thousands of points, like a zoomed out map view
+    """
+    rng = random.Random(seed)
+    points = random_points(rng, size)
+    return Workload("large_queries", points, random_queries(rng, size // 100, 333), random_points(rng, size // 10),
+                    list(zip(rng.sample(range(size), size // 10), random_points(rng, size // 10))),
+                    rng.sample(range(size), size // 10))
+
+
+WORKLOADS = {"uniform": uniform, "clustered": clustered, "moving_objects": moving_objects,
+             "delete_heavy": delete_heavy, "large_queries": large_queries}
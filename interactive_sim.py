@@ -1,4 +1,4 @@
-from pyquadtree import QuadTree
+from pyquadtree import QuadTree, Instrumentation
 import pygame
 import random
 
@@ -8,6 +8,10 @@ screen = pygame.display.set_mode((1000, 1000))
 # and a maximum of 10 points per node and a maximum depth of 10
 qtree = QuadTree((-500, -500, 500, 500), 3, 10)
 
+# Keeping the stats of the last call to each method, to show how much work the nearest neighbor search does
+last_stats = {}
+qtree.instrumentation = Instrumentation(callback=lambda stats: last_stats.__setitem__(stats.method, stats))
+
 camera_x = 0
 camera_y = 0
 
@@ -59,15 +63,15 @@ def interactive_test():
     clock = pygame.time.Clock()
     while True:
         for ball in fun_balls:
-            qtree.delete(ball)
             # ball.update()
-            ball.neighbor = qtree.nearest_neighbors((ball.x, ball.y))[0]
-            qtree.add(ball, (ball.x, ball.y))
+            qtree.move(ball, (ball.x, ball.y))
+            ball.neighbor = qtree.nearest_neighbors((ball.x, ball.y), condition=lambda x: x is not ball)[0]
 
         mouse_loc = pygame.mouse.get_pos()
         mouse_loc = (mouse_loc[0] + camera_x, mouse_loc[1] + camera_y)
         closest_to_mouse = qtree.nearest_neighbors(mouse_loc, condition=lambda x: x.radius > 5,
                                                    number_of_neighbors=2)
+        mouse_stats = last_stats["nearest_neighbors"]
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
@@ -126,10 +130,6 @@ def interactive_test():
             e_draw_loc = (e[0] - camera_x, e[1] - camera_y)
             pygame.draw.circle(screen, (255, 0, 0), e_draw_loc, 10, width=2)
 
-        for point in qtree.debug_elements_checked:
-            point_loc = (point[0] - camera_x, point[1] - camera_y)
-            pygame.draw.circle(screen, (0, 0, 255), point_loc, 2)
-
         for point in qtree.query(query_area):
             point_loc = (point[0] - camera_x, point[1] - camera_y)
             pygame.draw.circle(screen, (255, 0, 255), point_loc, 5, 2)
@@ -142,7 +142,8 @@ def interactive_test():
         screen.fill((0, 0, 0))
         clock.tick(60)
         fps = clock.get_fps()
-        pygame.display.set_caption(f"FPS: {fps}")
+        pygame.display.set_caption(f"FPS: {fps}, nodes visited: {mouse_stats.nodes_visited}, "
+                                   f"distances computed: {mouse_stats.distance_computations}")
 
 
 interactive_test()
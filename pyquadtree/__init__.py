@@ -1,3 +1,9 @@
-from .quadtree import QuadTree
+from .quadtree import QuadTree, QuadTreeSnapshot
+from .loose_quadtree import LooseQuadTree
+from .linear_quadtree import LinearQuadTree
+from .frozen_quadtree import FrozenQuadTree
+from .parallel import ParallelQueryExecutor
+from .instrumentation import Instrumentation
 
-__all__ = ["QuadTree"]
+__all__ = ["QuadTree", "QuadTreeSnapshot", "LooseQuadTree", "LinearQuadTree", "FrozenQuadTree", "ParallelQueryExecutor",
+           "Instrumentation"]
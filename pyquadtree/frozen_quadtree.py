@@ -0,0 +1,394 @@
+"""
+Read-only quadtree stored in one flat binary buffer
+
+The buffer has a header followed by arrays of numbers, so it can be written to a file as is and memory-mapped back
+without creating a Python object for every node. Only the items are pickled, in a side table at the end,
+and they aren't unpickled until an element is returned
+
+Layout, all little-endian:
+    header          magic, version, max_depth, node_count, element_count, items_size
+    bboxes          node_count * 4 doubles, (minx, miny, maxx, maxy) of each node
+    first_child     node_count int64, the index of the node's first child, its 4 children are next to each other
+                    -1 for leaves
+    ranges          node_count * 2 int64, (start, end) of the elements under the node
+                    The elements are in depth first order, so the elements of every node are next to each other
+    xs, ys          element_count doubles each
+    handles         element_count int64, the handle each element had in the QuadTree
+    items           the pickled list of the items, in the same order as the elements
+"""
+
+import gc
+import mmap
+import pickle
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from heapq import heappop, heappush, heapreplace
+from multiprocessing import resource_tracker, shared_memory
+
+from .quadtree import Element, contains_node, distance_sq_to_bbox, edge_bbox, neighbors_result
+
+MAGIC = b"PYQTREE\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIqqq")
+
+# Sections after the header, with their typecode and how many numbers they have per node and per element
+SECTIONS = (("bboxes", "d", 4, 0), ("first_child", "q", 1, 0), ("ranges", "q", 2, 0),
+            ("xs", "d", 0, 1), ("ys", "d", 0, 1), ("handles", "q", 0, 1))
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the garbage collector while making many elements
+    Making many objects keeps setting off the garbage collector, which goes through every object each time, and the
+    new elements can't be part of a reference cycle
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def freeze(qtree):
+    """
+    Convert a quadtree into the flat binary layout of FrozenQuadTree
+    :param qtree: The QuadTree
+    :return: The bytes
+    """
+    # The nodes are numbered breadth first, so the 4 children of a node get consecutive numbers
+    nodes = [qtree.root]
+    first_child = array("q")
+    for node in nodes:
+        if node.children:
+            first_child.append(len(nodes))
+            nodes.extend(node.children)
+        else:
+            first_child.append(-1)
+    node_numbers = {id(node): number for number, node in enumerate(nodes)}
+
+    bboxes = array("d")
+    for node in nodes:
+        bboxes.extend(node.bbox)
+
+    # The elements are added depth first, so every node's elements are in one range
+    ranges = array("q", bytes(16 * len(nodes)))
+    xs, ys, handles = array("d"), array("d"), array("q")
+    items = []
+    stack = [(qtree.root, False)]
+    while stack:
+        node, done = stack.pop()
+        number = node_numbers[id(node)]
+        if done:
+            ranges[2 * number + 1] = len(xs)
+            continue
+
+        ranges[2 * number] = len(xs)
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.children))
+        for element in node.elements:
+            xs.append(element.point[0])
+            ys.append(element.point[1])
+            handles.append(element.handle)
+            items.append(element.item)
+
+    items = pickle.dumps(items, pickle.HIGHEST_PROTOCOL)
+    header = HEADER.pack(MAGIC, VERSION, qtree.max_depth, len(nodes), len(xs), len(items))
+
+    sections = [bboxes, first_child, ranges, xs, ys, handles]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    return b"".join([header] + [section.tobytes() for section in sections] + [items])
+
+
+def load(path, use_mmap=True):
+    """
+    Load a frozen quadtree saved by QuadTree.save
+    :param path: The path of the file
+    :param use_mmap: If True, the file is memory-mapped instead of read, so it is only read as it is queried
+    :return: The FrozenQuadTree
+    """
+    with open(path, "rb") as file:
+        if use_mmap:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return FrozenQuadTree(mapped, owner=mapped)
+        return FrozenQuadTree(file.read())
+
+
+class FrozenQuadTree:
+    """
+    A read-only quadtree that queries a flat binary buffer directly, see QuadTree.freeze, save, and load
+    The elements returned are new Element objects, their node and index are None
+    """
+
+    def __init__(self, buffer, owner=None):
+        """
+        :param buffer: A buffer with the layout made by freeze, e.g. bytes, an mmap, or a shared memory buffer
+        :param owner: The object the buffer belongs to, closed by close
+        """
+        self.owner = owner
+        self.buffer = memoryview(buffer)
+
+        magic, version, self.max_depth, self.node_count, self.element_count, items_size = \
+            HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a frozen quadtree")
+        if version != VERSION:
+            raise ValueError("Unsupported frozen quadtree version " + str(version))
+
+        offset = HEADER.size
+        for name, typecode, per_node, per_element in SECTIONS:
+            length = per_node * self.node_count + per_element * self.element_count
+            section = self.buffer[offset:offset + 8 * length]
+            if sys.byteorder == "little":
+                section = section.cast(typecode)
+            else:
+                # A big-endian machine can't read the buffer in place, so the section is copied and swapped
+                section = array(typecode, section)
+                section.byteswap()
+            setattr(self, name, section)
+            offset += 8 * length
+
+        self.items_buffer = self.buffer[offset:offset + items_size]
+        self._items = None
+
+        self.root_bbox = tuple(self.bboxes[0:4])
+
+    @classmethod
+    def attach(cls, name, track=False):
+        """
+        Use a frozen quadtree that another process put in shared memory with to_shared_memory
+        Nothing is copied, the tree is queried directly in the shared memory
+        :param name: The name of the shared memory block
+        :param track: Keep the block registered with the resource tracker, only for processes started by
+                      multiprocessing from the process that made the block, since they share its resource tracker
+        :return: The FrozenQuadTree, call close on it when it is no longer needed
+        """
+        # Only the process that made the block should unlink it, a resource tracker of this process would unlink it
+        # when this process exits
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(name=name, track=track)
+        else:
+            # Attaching always registers the block before 3.13
+            block = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(block._name, "shared_memory")
+        return cls(block.buf, owner=block)
+
+    def to_shared_memory(self, name=None):
+        """
+        Copy the tree into a new block of shared memory, so other processes can attach to it without copying it
+        The block stays around until unlink is called on the returned tree
+        :param name: The name of the block, a random name is picked by default
+        :return: A FrozenQuadTree in the shared memory, its name is passed to attach
+        """
+        block = shared_memory.SharedMemory(name=name, create=True, size=len(self.buffer))
+        block.buf[:len(self.buffer)] = self.buffer
+        return FrozenQuadTree(block.buf, owner=block)
+
+    @property
+    def name(self):
+        """
+        The name of the shared memory block the tree is in, None if it isn't in shared memory
+        """
+        if isinstance(self.owner, shared_memory.SharedMemory):
+            return self.owner.name
+        return None
+
+    def unlink(self):
+        """
+        Free the shared memory block the tree is in once every process has closed it
+        Should only be called by the process that called to_shared_memory
+        """
+        self.owner.unlink()
+
+    @property
+    def items(self):
+        """
+        The items of the elements, unpickled the first time they are needed
+        """
+        if self._items is None:
+            self._items = pickle.loads(self.items_buffer)
+        return self._items
+
+    def element(self, index):
+        """
+        Create the Element at an index of the element arrays
+        :param index: The index
+        :return: The element
+        """
+        return Element(self.items[index], (self.xs[index], self.ys[index]), self.handles[index])
+
+    def elements(self, indices):
+        """
+        Create the Elements at many indices of the element arrays, faster than calling element for each one
+        :param indices: An iterable of indices
+        :return: A list of elements
+        """
+        items, xs, ys, handles = self.items, self.xs, self.ys, self.handles
+        with paused_gc():
+            return [Element(items[i], (xs[i], ys[i]), handles[i]) for i in indices]
+
+    def query(self, bbox):
+        """
+        Query the quadtree for all elements within a bounding box
+        Same as QuadTree.query
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: A list of elements (maybe empty)
+        """
+        return self.elements(self._query_indices(bbox))
+
+    def _query_indices(self, bbox):
+        """
+        The search used by query
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: A list of the indices of the elements within the bounding box
+        """
+        minx, miny, maxx, maxy = bbox
+        rminx, rminy, rmaxx, rmaxy = self.root_bbox
+        bboxes, first_child, ranges, xs, ys = self.bboxes, self.first_child, self.ranges, self.xs, self.ys
+
+        indices = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            start, end = ranges[2 * node], ranges[2 * node + 1]
+            if start == end:
+                continue
+            node_bbox = nminx, nminy, nmaxx, nmaxy = tuple(bboxes[4 * node:4 * node + 4])
+            child = first_child[node]
+
+            if child >= 0:
+                if contains_node(bbox, node_bbox, self.root_bbox):
+                    indices.extend(range(start, end))
+                    continue
+
+                # Same order and midline rules as QuadTree._query_nodes
+                midx = (nminx + nmaxx) / 2
+                midy = (nminy + nmaxy) / 2
+                top = miny <= midy
+                bottom = maxy > midy
+                if minx <= midx:
+                    if top:
+                        stack.append(child)
+                    if bottom:
+                        stack.append(child + 1)
+                if maxx > midx:
+                    if top:
+                        stack.append(child + 2)
+                    if bottom:
+                        stack.append(child + 3)
+                continue
+
+            # Same as filter_leaf
+            check_x = not (minx <= nminx and nmaxx < maxx) or nminx == rminx or nmaxx == rmaxx
+            check_y = not (miny <= nminy and nmaxy < maxy) or nminy == rminy or nmaxy == rmaxy
+            if check_x and check_y:
+                indices.extend([i for i in range(start, end) if minx <= xs[i] < maxx and miny <= ys[i] < maxy])
+            elif check_x:
+                indices.extend([i for i in range(start, end) if minx <= xs[i] < maxx])
+            elif check_y:
+                indices.extend([i for i in range(start, end) if miny <= ys[i] < maxy])
+            else:
+                indices.extend(range(start, end))
+
+        return indices
+
+    def nearest_neighbors(self, point: tuple, condition=None, max_distance=float('inf'),
+                          number_of_neighbors=1, return_distances=False):
+        """
+        Finding the elements in the quadtree closest to the given point
+        Same best first search as QuadTree.nearest_neighbors
+        :param point: The point to find the nearest neighbor for
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :param max_distance: The maximum distance to search for a point
+        :param number_of_neighbors: The number of neighbors to find
+        :param return_distances: If True, a list of (element, distance) tuples is returned instead
+        :return: List of the nearest neighbors found from closest to furthest. len <= number_of_neighbors
+        """
+        if number_of_neighbors < 1:
+            return []
+        found = self._nearest(point, number_of_neighbors, max_distance ** 2, condition)
+        return neighbors_result([(distance_sq, self.element(i)) for distance_sq, i in found], return_distances)
+
+    def _nearest(self, point, number_of_neighbors, bound_sq, condition):
+        """
+        The best first search used by nearest_neighbors
+        :param point: The point to find the nearest neighbors for
+        :param number_of_neighbors: The number of neighbors to find, at least 1
+        :param bound_sq: Only elements closer than this distance squared are considered
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :return: A list of (distance_sq, index) of the elements from closest to furthest
+        """
+        if not self.element_count:
+            return []
+
+        px, py = point
+        bboxes, first_child, ranges, xs, ys = self.bboxes, self.first_child, self.ranges, self.xs, self.ys
+        items = self.items if condition is not None else None
+
+        # Max heap of (-distance_sq, index), the index also breaks ties in the order the elements are stored
+        candidates = []
+        root_bbox = self.root_bbox
+        # Points outside of the root's bbox are in the nodes on its edge, so the root is always searched
+        nodes_to_check = [(0, 0)]
+
+        while nodes_to_check:
+            node_distance_sq, node = heappop(nodes_to_check)
+            if node_distance_sq >= bound_sq:
+                break
+
+            first = first_child[node]
+            if first >= 0:
+                for child in range(first, first + 4):
+                    if ranges[2 * child] == ranges[2 * child + 1]:
+                        continue
+                    child_distance_sq = distance_sq_to_bbox(point, edge_bbox(bboxes[4 * child:4 * child + 4], root_bbox))
+                    if child_distance_sq < bound_sq:
+                        heappush(nodes_to_check, (child_distance_sq, child))
+            else:
+                for i in range(ranges[2 * node], ranges[2 * node + 1]):
+                    dx = px - xs[i]
+                    dy = py - ys[i]
+                    distance_sq = dx * dx + dy * dy
+                    if distance_sq < bound_sq and (condition is None or condition(items[i])):
+                        if len(candidates) < number_of_neighbors:
+                            heappush(candidates, (-distance_sq, -i))
+                        else:
+                            heapreplace(candidates, (-distance_sq, -i))
+                        if len(candidates) == number_of_neighbors:
+                            bound_sq = -candidates[0][0]
+
+        candidates.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+        return [(-negative_distance_sq, -negative_index) for negative_distance_sq, negative_index in candidates]
+
+    def get_all_bbox(self):
+        return [tuple(self.bboxes[4 * node:4 * node + 4]) for node in range(self.node_count)]
+
+    def get_all_elements(self):
+        return self.elements(range(self.element_count))
+
+    def close(self):
+        """
+        Release the buffer and close what it belongs to, e.g. the memory-mapped file
+        The tree can't be used afterwards
+        """
+        for name, _, _, _ in SECTIONS:
+            section = getattr(self, name)
+            if isinstance(section, memoryview):
+                section.release()
+        self.items_buffer.release()
+        self.buffer.release()
+        if self.owner is not None:
+            self.owner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,211 @@
+"""
+Opt-in statistics about how the quadtree is used, for tuning max_elements and max_depth from real traffic
+
+Set QuadTree.instrumentation to an Instrumentation to turn it on, it is None by default.
+While it is None nothing is counted or timed, the instrumented methods only check that it is None.
+Each call to an instrumented method is one operation, and the work it does is counted in an OperationStats.
+The operation in progress is kept per thread, so one Instrumentation can be shared by trees used from many threads.
+For methods that return generators, the operation lasts from the first element asked for until the generator is
+exhausted or closed, and only the time spent inside the generator is counted as its latency
+"""
+
+import threading
+from functools import wraps
+from inspect import isgeneratorfunction
+from time import perf_counter
+
+# The counters of an OperationStats
+COUNTERS = ("nodes_visited", "nodes_pruned", "distance_computations", "elements_filtered", "splits", "merges")
+
+
+class OperationStats:
+    """
+    The work done by one call to an instrumented method
+    nodes_visited: nodes whose bounding box or elements were looked at
+    nodes_pruned: nodes skipped because their bounding box couldn't have any of the elements searched for
+    distance_computations: distances calculated from a point to an element or a bounding box
+    elements_filtered: elements compared against a query's bounding box
+    splits, merges: nodes split and merged
+    """
+    __slots__ = ("method", "start", "latency") + COUNTERS
+
+    def __init__(self, method):
+        """
+        :param method: The name of the method
+        """
+        self.method = method
+        self.start = perf_counter()
+        # The time the call took in seconds, set when it returns
+        # For a generator it adds up the time before each time it was paused
+        self.latency = None
+
+        self.nodes_visited = 0
+        self.nodes_pruned = 0
+        self.distance_computations = 0
+        self.elements_filtered = 0
+        self.splits = 0
+        self.merges = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Instrumentation:
+    def __init__(self, callback=None):
+        """
+        :param callback: A function called with the OperationStats after every operation
+        """
+        self.callback = callback
+
+        # The OperationStats in progress on each thread
+        self.local = threading.local()
+
+        # Totals for each method, merged in as the operations end
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.totals = {}
+        self.histograms = {}
+
+    def begin(self, method):
+        """
+        Start counting an operation on this thread
+        Calls made inside of an operation, like add_many calling add, are counted as part of it
+        :param method: The name of the method
+        :return: The OperationStats, or None if an operation is already in progress
+        """
+        if getattr(self.local, "current", None) is not None:
+            return None
+        stats = OperationStats(method)
+        self.local.current = stats
+        return stats
+
+    def end(self, stats):
+        """
+        Finish an operation started by begin
+        :param stats: The OperationStats from begin
+        """
+        if stats is None:
+            return
+        # A paused operation already has its latency up to when it was paused
+        if self.current() is stats:
+            stats.latency = (stats.latency or 0) + perf_counter() - stats.start
+            self.local.current = None
+
+        # Latencies are bucketed by powers of 2 microseconds, the bucket is the number of bits of the microseconds
+        bucket = int(stats.latency * 1e6).bit_length()
+        with self.lock:
+            self.calls[stats.method] = self.calls.get(stats.method, 0) + 1
+            totals = self.totals.setdefault(stats.method, dict.fromkeys(COUNTERS, 0))
+            for name in COUNTERS:
+                totals[name] += getattr(stats, name)
+            histogram = self.histograms.setdefault(stats.method, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+        if self.callback is not None:
+            self.callback(stats)
+
+    def pause(self, stats):
+        """
+        Stop counting an operation on this thread until it is resumed, used while a generator is suspended
+        :param stats: The OperationStats from begin
+        """
+        stats.latency = (stats.latency or 0) + perf_counter() - stats.start
+        self.local.current = None
+
+    def resume(self, stats):
+        """
+        Continue counting a paused operation on this thread
+        If another operation is in progress it is left alone, and this one isn't timed until it is resumed again
+        :param stats: The OperationStats from begin
+        :return: True if the operation was resumed
+        """
+        if self.current() is not None:
+            return False
+        stats.start = perf_counter()
+        self.local.current = stats
+        return True
+
+    def current(self):
+        """
+        :return: The OperationStats in progress on this thread, or None
+        """
+        return getattr(self.local, "current", None)
+
+    def latency_histogram(self, method):
+        """
+        The latencies of a method's calls
+        :param method: The name of the method
+        :return: A list of (upper bound in seconds, number of calls) from fastest to slowest
+                 Each bucket has the calls slower than the bound before it, up to its own bound
+        """
+        with self.lock:
+            histogram = dict(self.histograms.get(method, {}))
+        return [((1 << bucket) / 1e6, histogram[bucket]) for bucket in sorted(histogram)]
+
+    def summary(self):
+        """
+        :return: A dictionary from each method to its number of calls and the totals of its counters
+        """
+        with self.lock:
+            return {method: dict(self.totals[method], calls=self.calls[method]) for method in self.calls}
+
+    def reset(self):
+        """
+        Forget the totals and latencies so far
+        """
+        with self.lock:
+            self.calls.clear()
+            self.totals.clear()
+            self.histograms.clear()
+
+
+def instrumented(method):
+    """
+    Decorator for the QuadTree methods that count as an operation
+    Does nothing besides checking self.instrumentation while it is None
+    """
+    name = method.__name__
+
+    if isgeneratorfunction(method):
+        @wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            stats = None if instrumentation is None else instrumentation.begin(name)
+            if stats is None:
+                # Not instrumented, or part of an operation that is already being counted
+                return (yield from method(self, *args, **kwargs))
+
+            # The operation is only current while the generator runs, not while the caller uses what it yielded
+            generator = method(self, *args, **kwargs)
+            running = True
+            try:
+                while True:
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        return
+                    if running:
+                        instrumentation.pause(stats)
+                    try:
+                        yield value
+                    finally:
+                        running = instrumentation.resume(stats)
+            finally:
+                generator.close()
+                instrumentation.end(stats)
+
+        return generator_wrapper
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+
+        stats = instrumentation.begin(name)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            instrumentation.end(stats)
+
+    return wrapper
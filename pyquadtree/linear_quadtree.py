@@ -0,0 +1,384 @@
+"""
+Linear quadtree, the points are kept in flat arrays sorted along a Z-order (Morton) curve instead of in nodes
+
+Each point's key is the Morton code of its cell on a grid of 2 ** max_depth by 2 ** max_depth cells, see morton.py.
+Every node of a quadtree over that grid is a range of keys, so the nodes don't have to be stored:
+a node's points are found with a binary search.
+Queries walk these implicit nodes from the top down and stop splitting a node once it has max_elements points or less
+
+Experimental, and only meant for read-mostly trees built with from_points: queries that find many points are faster
+than in a QuadTree, since a node inside the query is one slice of the arrays, but add, delete and move have to shift
+the arrays and are several times slower
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush, heapreplace
+from math import inf
+
+from .morton import grid_cell, interleave
+from .quadtree import Element, build_from_points, distance_sq_to_bbox, neighbors_result
+
+# The most elements move shifts over one at a time,
+# past this removing and inserting the element is faster since those are single memory moves
+SHIFT_LIMIT = 256
+
+
+class LinearQuadTree:
+    def __init__(self, bbox: tuple, max_elements=64, max_depth=10, track_items=True):
+        """
+        :param bbox: The bounding box of the entire quadtree
+        :param max_elements: Queries stop splitting a node once it has this many points or less
+                             Splitting a node costs more here than in a QuadTree, so the default is larger
+        :param max_depth: The number of levels in the tree, the grid has 2 ** max_depth cells on each side
+                          Can't be more than 31
+        :param track_items: If True, item_to_point_map is kept so items can be deleted by the item itself
+                            If False, items don't need to be hashable but can only be deleted by their handle
+        """
+        if not 0 <= max_depth <= 31:
+            raise ValueError("max_depth has to be from 0 to 31")
+
+        self.bbox = bbox
+        self.max_elements = max_elements
+        self.max_depth = max_depth
+        self.track_items = track_items
+
+        # The number of grid cells on each side and their size
+        self.cells = 1 << max_depth
+        self.cell_width = ((bbox[2] - bbox[0]) or 1) / self.cells
+        self.cell_height = ((bbox[3] - bbox[1]) or 1) / self.cells
+
+        # The elements sorted by the keys of their points, the same index in each is the same element
+        # The coordinates are copied into arrays so a node's points can be compared without touching the elements
+        self.keys = array("q")
+        self.xs = array("d")
+        self.ys = array("d")
+        self.elements = []
+
+        self.item_to_point_map = {}
+        self.handle_to_element_map = {}
+        self.next_handle = 0
+
+    def cell(self, point):
+        """
+        Find the grid cell of a point, see morton.grid_cell
+        :param point: The point
+        :return: The column and row of the cell
+        """
+        return grid_cell(point, self.bbox, self.max_depth)
+
+    def key(self, point):
+        """
+        The Morton code of a point's cell
+        :param point: The point
+        :return: The key
+        """
+        return interleave(*grid_cell(point, self.bbox, self.max_depth))
+
+    @classmethod
+    def from_points(cls, points, items=None, bbox=None, max_elements=64, max_depth=10, **kwargs):
+        """
+        Build a linear quadtree from many points at once with a single sort, see QuadTree.from_points
+        """
+        return build_from_points(cls, points, items, bbox, max_elements, max_depth, **kwargs)
+
+    def add_many(self, items, points):
+        """
+        Insert many items into the quadtree at once
+        The new elements are merged with the old ones by sorting them all by key once
+        :param items: A sequence of the items to store
+        :param points: A sequence of (x, y) points, one for each item
+        :return: A list of the integer handles of the new elements
+        """
+        new_elements = []
+        for item, point in zip(items, points):
+            point = tuple(point)
+            new_element = Element(item, point, self.next_handle)
+            self.handle_to_element_map[self.next_handle] = new_element
+            self.next_handle += 1
+            new_elements.append(new_element)
+            if self.track_items:
+                self.item_to_point_map[item] = point
+
+        keys = self.keys.tolist() + [self.key(e.point) for e in new_elements]
+        elements = self.elements + new_elements
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = array("q", [keys[i] for i in order])
+        self.elements = [elements[i] for i in order]
+        self.xs = array("d", [e.point[0] for e in self.elements])
+        self.ys = array("d", [e.point[1] for e in self.elements])
+        return [e.handle for e in new_elements]
+
+    def add(self, item, point: tuple):
+        """
+        Insert an item into the quadtree at the location specified by point
+        The elements after it are shifted over, so this is O(n), but the shift is a single memory move
+        :param item: The item to store which can be any object
+        :param point: A tuple with the x and y coordinate for the item
+        :return: The integer handle of the new element, can be used to delete it
+        """
+        new_element = Element(item, point, self.next_handle)
+        self.handle_to_element_map[self.next_handle] = new_element
+        self.next_handle += 1
+        if self.track_items:
+            self.item_to_point_map[item] = point
+
+        self._insert(new_element)
+        return new_element.handle
+
+    def _insert(self, element):
+        key = self.key(element.point)
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.xs.insert(index, element.point[0])
+        self.ys.insert(index, element.point[1])
+        self.elements.insert(index, element)
+
+    def _index(self, element):
+        """
+        Find where an element is by searching the elements with the same key
+        :param element: The element
+        :return: Its index in keys, xs, ys, and elements
+        """
+        index = bisect_left(self.keys, self.key(element.point))
+        elements = self.elements
+        while elements[index] is not element:
+            index += 1
+        return index
+
+    def _remove(self, index):
+        del self.keys[index]
+        del self.xs[index]
+        del self.ys[index]
+        del self.elements[index]
+
+    def _find_element(self, item, handle):
+        """
+        Find the element of an item or a handle
+        :param item: The item, used if handle is None
+        :param handle: The handle of the element
+        :return: The element and its index
+        """
+        if handle is not None:
+            element = self.handle_to_element_map[handle]
+            return element, self._index(element)
+
+        if not self.track_items:
+            raise ValueError("Items are not tracked, use the handle instead")
+        point = self.item_to_point_map[item]
+        key = self.key(point)
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            element = self.elements[index]
+            if element.item == item and element.point == point:
+                return element, index
+            index += 1
+        raise KeyError(item)
+
+    def delete(self, item=None, handle=None):
+        """
+        Delete an item from the quadtree
+        :param item: The item to delete
+        :param handle: The handle returned by add, used instead of the item
+        """
+        element, index = self._find_element(item, handle)
+        self._remove(index)
+        del self.handle_to_element_map[element.handle]
+        # An item added more than once is only mapped to the point it was added or moved to last
+        if self.track_items and self.item_to_point_map.get(element.item) == element.point:
+            del self.item_to_point_map[element.item]
+
+    def move(self, item=None, new_point=None, handle=None):
+        """
+        Move an item to a new point
+        If it doesn't move far along the curve, only the elements between its old and new place are shifted over
+        :param item: The item to move
+        :param new_point: A tuple with the new x and y coordinate for the item
+        :param handle: The handle returned by add, used instead of the item
+        """
+        element, index = self._find_element(item, handle)
+        element.point = new_point
+        if self.track_items:
+            self.item_to_point_map[element.item] = new_point
+
+        key = self.key(new_point)
+        keys, xs, ys, elements = self.keys, self.xs, self.ys, self.elements
+        if key > keys[index]:
+            new_index = bisect_right(keys, key, index) - 1
+        elif key < keys[index]:
+            new_index = bisect_right(keys, key, 0, index)
+        else:
+            new_index = index
+
+        if abs(new_index - index) > SHIFT_LIMIT:
+            self._remove(index)
+            self._insert(element)
+            return
+
+        # Only the elements between the old and the new index are shifted over, so small moves are cheap
+        if new_index > index:
+            keys[index:new_index] = keys[index + 1:new_index + 1]
+            xs[index:new_index] = xs[index + 1:new_index + 1]
+            ys[index:new_index] = ys[index + 1:new_index + 1]
+            elements[index:new_index] = elements[index + 1:new_index + 1]
+        elif new_index < index:
+            keys[new_index + 1:index + 1] = keys[new_index:index]
+            xs[new_index + 1:index + 1] = xs[new_index:index]
+            ys[new_index + 1:index + 1] = ys[new_index:index]
+            elements[new_index + 1:index + 1] = elements[new_index:index]
+        keys[new_index] = key
+        xs[new_index] = new_point[0]
+        ys[new_index] = new_point[1]
+        elements[new_index] = element
+
+    def _children(self, column, row, size, first_key, start, end):
+        """
+        Split an implicit node into its 4 children, the empty ones are left out
+        The children's keys are 4 equal blocks of the node's keys, so their elements are found with binary searches
+        :return: A list of (column, row, size, first key, start, end) for each child
+        """
+        keys = self.keys
+        half = size // 2
+        quarter = half * half
+        children = []
+        for child in range(4):
+            child_first_key = first_key + child * quarter
+            child_end = end if child == 3 else bisect_left(keys, child_first_key + quarter, start, end)
+            if start < child_end:
+                children.append((column + half * (child >> 1), row + half * (child & 1), half,
+                                 child_first_key, start, child_end))
+            start = child_end
+        return children
+
+    def query(self, bbox):
+        """
+        Query the quadtree for all elements within a bounding box
+        Same as QuadTree.query, the max edges are exclusive
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: A list of elements (maybe empty)
+        """
+        minx, miny, maxx, maxy = bbox
+        if not minx < maxx or not miny < maxy:
+            return []
+
+        # The cell of every point within the bbox is between these cells, since cell only ever rounds down.
+        # So every point in a cell strictly between them is within the bbox and doesn't have to be compared
+        min_column, min_row = self.cell((minx, miny))
+        max_column, max_row = self.cell((maxx, maxy))
+
+        xs, ys, elements = self.xs, self.ys, self.elements
+        found = []
+
+        # Implicit nodes as (column, row, size in cells, key of the first cell, start, end)
+        # where start and end are the indices of the node's elements.
+        # The search starts at the smallest node with all of the cells instead of at the root,
+        # its size is the highest bit where the columns or the rows of the corners are different
+        size = 1 << max((min_column ^ max_column).bit_length(), (min_row ^ max_row).bit_length())
+        column = min_column & -size
+        row = min_row & -size
+        first_key = interleave(column, row)
+        stack = [(column, row, size, first_key, bisect_left(self.keys, first_key),
+                  bisect_left(self.keys, first_key + size * size))]
+        while stack:
+            node = stack.pop()
+            column, row, size, first_key, start, end = node
+            last_column = column + size - 1
+            last_row = row + size - 1
+
+            if min_column < column and last_column < max_column and min_row < row and last_row < max_row:
+                found.extend(elements[start:end])
+            elif end - start <= self.max_elements or size == 1:
+                found.extend([e for x, y, e in zip(xs[start:end], ys[start:end], elements[start:end])
+                              if minx <= x < maxx and miny <= y < maxy])
+            else:
+                for child in self._children(*node):
+                    child_column, child_row, half = child[0], child[1], child[2]
+                    if (child_column <= max_column and min_column < child_column + half and
+                            child_row <= max_row and min_row < child_row + half):
+                        stack.append(child)
+        return found
+
+    def nearest_neighbors(self, point: tuple, condition=None, max_distance=float('inf'),
+                          number_of_neighbors=1, return_distances=False):
+        """
+        Finding the elements in the quadtree closest to the given point
+        Same best first search as QuadTree.nearest_neighbors over the implicit nodes,
+        but points outside of the bbox are always found too
+        :param point: The point to find the nearest neighbor for
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :param max_distance: The maximum distance to search for a point
+        :param number_of_neighbors: The number of neighbors to find
+        :param return_distances: If True, a list of (element, distance) tuples is returned instead
+        :return: List of the nearest neighbors found from closest to furthest. len <= number_of_neighbors
+        """
+        if number_of_neighbors < 1 or not self.elements:
+            return []
+
+        px, py = point
+        bound_sq = max_distance ** 2
+        xs, ys, elements = self.xs, self.ys, self.elements
+        minx, miny = self.bbox[0], self.bbox[1]
+        cell_width, cell_height, cells = self.cell_width, self.cell_height, self.cells
+
+        # Max heap of (-distance_sq, -index) of the closest elements found so far
+        # The index breaks ties between equal distances so the elements themselves are never compared
+        candidates = []
+        # Min heap of the implicit nodes to check, ordered by the distance to their bounding box
+        nodes_to_check = [(0, (0, 0, self.cells, 0, 0, len(elements)))]
+
+        while nodes_to_check:
+            node_distance_sq, node = heappop(nodes_to_check)
+            if node_distance_sq >= bound_sq:
+                break
+
+            start, end = node[4], node[5]
+            if end - start <= self.max_elements or node[2] == 1:
+                for i in range(start, end):
+                    dx = px - xs[i]
+                    dy = py - ys[i]
+                    distance_sq = dx * dx + dy * dy
+                    if distance_sq < bound_sq and (condition is None or condition(elements[i].item)):
+                        if len(candidates) < number_of_neighbors:
+                            heappush(candidates, (-distance_sq, -i))
+                        else:
+                            heapreplace(candidates, (-distance_sq, -i))
+                        if len(candidates) == number_of_neighbors:
+                            bound_sq = -candidates[0][0]
+                continue
+
+            for child in self._children(*node):
+                column, row, size = child[0], child[1], child[2]
+                # The nodes on the edges of the grid also hold the points outside of the bbox,
+                # so their bounding box goes on forever past those edges
+                child_bbox = (minx + column * cell_width if column else -inf,
+                              miny + row * cell_height if row else -inf,
+                              minx + (column + size) * cell_width if column + size < cells else inf,
+                              miny + (row + size) * cell_height if row + size < cells else inf)
+                child_distance_sq = distance_sq_to_bbox(point, child_bbox)
+                if child_distance_sq < bound_sq:
+                    heappush(nodes_to_check, (child_distance_sq, child))
+
+        # Closest first, elements at the same distance are in the order they are stored
+        candidates.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+        return neighbors_result([(-negative_distance_sq, elements[-negative_index])
+                                 for negative_distance_sq, negative_index in candidates], return_distances)
+
+    def get_all_elements(self):
+        return list(self.elements)
+
+    def get_all_bbox(self):
+        """
+        The bounding boxes of the implicit nodes that queries stop at when they get to them, for drawing the tree
+        :return: A list of bounding boxes (minx, miny, maxx, maxy)
+        """
+        minx, miny = self.bbox[0], self.bbox[1]
+        bboxes = []
+        stack = [(0, 0, self.cells, 0, 0, len(self.elements))]
+        while stack:
+            node = stack.pop()
+            column, row, size = node[0], node[1], node[2]
+            bboxes.append((minx + column * self.cell_width, miny + row * self.cell_height,
+                           minx + (column + size) * self.cell_width, miny + (row + size) * self.cell_height))
+            if node[5] - node[4] > self.max_elements and size > 1:
+                stack.extend(self._children(*node))
+        return bboxes
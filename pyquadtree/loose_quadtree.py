@@ -0,0 +1,304 @@
+"""
+Loose quadtree for items that have a size, such as rectangles or circles, instead of a single point
+
+Every node has a loose bounding box, its bounding box grown on every side, and an item is stored in the deepest
+node whose loose bounding box fully contains the item's bounding box. So each item is stored exactly once,
+unlike quadtrees that add an item to every node it overlaps, and a query never has to remove duplicates.
+Unlike QuadTree, items can be stored in any node, not just the leaves.
+"""
+
+
+def intersects(a, b):
+    """
+    Check if two bounding boxes intersect, touching edges count as intersecting
+    :param a: A bounding box (minx, miny, maxx, maxy)
+    :param b: Another bounding box
+    :return: True if they intersect, False otherwise
+    """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def contains(outer, inner):
+    """
+    Check if a bounding box fully contains another
+    :param outer: The bounding box (minx, miny, maxx, maxy) that should be on the outside
+    :param inner: The bounding box that should be on the inside
+    :return: True if inner is within outer, False otherwise
+    """
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class BoxElement:
+    """
+    A wrapper class for an item with a bounding box stored in the loose quadtree
+    """
+    __slots__ = ("item", "bbox", "handle", "node", "index")
+
+    def __init__(self, item, bbox: tuple, handle=None):
+        """
+        :param item: Any object to be stored
+        :param bbox: The bounding box of the item (minx, miny, maxx, maxy)
+        :param handle: The integer handle given to the element by the quadtree
+        """
+        self.item = item
+        self.bbox = bbox
+        self.handle = handle
+
+        # The node the element is stored in and its index in that node's elements
+        self.node = None
+        self.index = None
+
+    @property
+    def point(self):
+        """
+        The center of the element's bounding box
+        """
+        return (self.bbox[0] + self.bbox[2]) / 2, (self.bbox[1] + self.bbox[3]) / 2
+
+    def __eq__(self, other):
+        return self.bbox == other.bbox and self.item == other.item
+
+
+class LooseNode:
+    __slots__ = ("bbox", "loose_bbox", "elements", "children", "depth", "parent", "count")
+
+    def __init__(self, bbox: tuple, depth, looseness, parent=None):
+        """
+        :param bbox: tuple with minx, miny, maxx, maxy
+        :param depth: The number of levels above this node
+        :param looseness: How many times bigger the loose bounding box is than the bounding box
+        :param parent: The node this node is a child of, None for the root
+        """
+        self.bbox = bbox
+        self.elements = []
+        self.children = []
+        self.depth = depth
+        self.parent = parent
+
+        # The number of elements in this node and all of its descendants
+        self.count = 0
+
+        minx, miny, maxx, maxy = bbox
+        margin_x = (maxx - minx) * (looseness - 1) / 2
+        margin_y = (maxy - miny) * (looseness - 1) / 2
+        self.loose_bbox = (minx - margin_x, miny - margin_y, maxx + margin_x, maxy + margin_y)
+
+    def child_for(self, bbox):
+        """
+        Find the child whose loose bounding box fully contains a bounding box
+        The child is picked by the center of the bounding box, with the same child order as Node
+        :param bbox: The bounding box
+        :return: The child, or None if the bounding box is too big for it
+        """
+        midx = (self.bbox[0] + self.bbox[2]) / 2
+        midy = (self.bbox[1] + self.bbox[3]) / 2
+        child = self.children[2 * ((bbox[0] + bbox[2]) / 2 > midx) + ((bbox[1] + bbox[3]) / 2 > midy)]
+        if contains(child.loose_bbox, bbox):
+            return child
+        return None
+
+    def insert(self, element, tree):
+        """
+        Insert an element into the deepest node under this node that fits it
+        Will split the node it ends up in if it has too many elements
+        :param element: The element to store
+        :param tree: The LooseQuadTree this node belongs to
+        """
+        node = self
+        node.count += 1
+        while node.children:
+            child = node.child_for(element.bbox)
+            if child is None:
+                break
+            node = child
+            node.count += 1
+
+        element.node = node
+        element.index = len(node.elements)
+        node.elements.append(element)
+        if not node.children and len(node.elements) > tree.max_elements and node.depth < tree.max_depth:
+            node.split(tree)
+
+    def remove(self, element):
+        """
+        Remove an element from this node in O(1)
+        The last element is moved into the removed element's place, so the order of the elements changes
+        Call merge_up afterwards to merge the nodes that no longer have too many elements
+        :param element: The element to remove, must be stored in this node
+        """
+        last = self.elements.pop()
+        if last is not element:
+            self.elements[element.index] = last
+            last.index = element.index
+        element.node = None
+
+        node = self
+        while node is not None:
+            node.count -= 1
+            node = node.parent
+
+    def merge_up(self, tree):
+        """
+        Merge this node and its ancestors for as long as all the elements under them fit in them
+        :param tree: The LooseQuadTree this node belongs to
+        """
+        node = self if self.children else self.parent
+        while (node is not None and node.count <= tree.max_elements
+               and not any(child.children for child in node.children)):
+            node.merge()
+            node = node.parent
+
+    def split(self, tree):
+        """
+        Split the node into four sub-nodes
+        The elements that fit in a child are moved down, the bigger ones stay in this node
+        :param tree: The LooseQuadTree this node belongs to
+        """
+        minx, miny, maxx, maxy = self.bbox
+        midx = (minx + maxx) / 2
+        midy = (miny + maxy) / 2
+        depth = self.depth + 1
+
+        self.children = [LooseNode((minx, miny, midx, midy), depth, tree.looseness, self),
+                         LooseNode((minx, midy, midx, maxy), depth, tree.looseness, self),
+                         LooseNode((midx, miny, maxx, midy), depth, tree.looseness, self),
+                         LooseNode((midx, midy, maxx, maxy), depth, tree.looseness, self)]
+
+        elements = self.elements
+        self.elements = []
+        for element in elements:
+            child = self.child_for(element.bbox)
+            if child is None:
+                element.index = len(self.elements)
+                self.elements.append(element)
+            else:
+                child.insert(element, tree)
+
+    def merge(self):
+        """
+        Take all the elements from my children and add them to me
+        Also remove my children
+        """
+        for child in self.children:
+            self.elements.extend(child.elements)
+        self.children = []
+
+        for index, element in enumerate(self.elements):
+            element.node = self
+            element.index = index
+
+    def get_bbox(self, all_bbox):
+        all_bbox += [self.bbox]
+        for child in self.children:
+            child.get_bbox(all_bbox)
+
+    def __str__(self):
+        return str(self.depth) + "-" + str(self.bbox)
+
+
+class LooseQuadTree:
+    def __init__(self, bbox: tuple, max_elements=10, max_depth=10, looseness=2.0):
+        """
+        :param bbox: The bounding box of the entire quadtree
+        :param max_elements: The maximum number of items in a leaf node before it splits
+        :param max_depth: The maximum number of levels in the tree
+        :param looseness: How many times bigger each node's loose bounding box is than its bounding box
+                          With the default of 2, an item fits in a node if it is no bigger than the node
+                          and its center is inside the node
+        """
+        if looseness < 1:
+            raise ValueError("looseness can't be less than 1")
+
+        # Map for quick lookup of an item's bounding box
+        self.item_to_bbox_map = {}
+
+        # Every element gets an integer handle when it is added
+        self.handle_to_element_map = {}
+        self.next_handle = 0
+
+        self.max_elements = max_elements
+        self.max_depth = max_depth
+        self.looseness = looseness
+
+        self.root = LooseNode(bbox, 0, looseness)
+
+    def add(self, item, bbox: tuple):
+        """
+        Insert an item into the quadtree with the bounding box it covers
+        :param item: The item to store which can be any object
+        :param bbox: The bounding box of the item (minx, miny, maxx, maxy), use (x, y, x, y) for a point
+        :return: The integer handle of the new element, can be used to delete it
+        """
+        new_element = BoxElement(item, bbox, self.next_handle)
+        self.handle_to_element_map[self.next_handle] = new_element
+        self.next_handle += 1
+
+        self.item_to_bbox_map[item] = bbox
+
+        self.root.insert(new_element, self)
+        return new_element.handle
+
+    def delete(self, item=None, handle=None):
+        """
+        Delete an item from the quadtree
+        Will restructure the quadtree if necessary, i.e. a parent node has less than max_elements
+        :param item: The item to delete
+        :param handle: The handle returned by add, used instead of the item
+        """
+        if handle is not None:
+            element = self.handle_to_element_map.pop(handle)
+        else:
+            element = self._find_element(item, self.item_to_bbox_map[item])
+            del self.handle_to_element_map[element.handle]
+        # An item added more than once is only mapped to the bounding box it was added with last
+        if self.item_to_bbox_map.get(element.item) == element.bbox:
+            del self.item_to_bbox_map[element.item]
+
+        node = element.node
+        node.remove(element)
+        node.merge_up(self)
+
+    def _find_element(self, item, bbox):
+        """
+        Find the stored element of an item by searching the nodes that could fit its bounding box
+        :param item: The item
+        :param bbox: The bounding box the item is stored with
+        :return: The element
+        """
+        target = BoxElement(item, bbox)
+        node = self.root
+        while node is not None:
+            for e in node.elements:
+                if e == target:
+                    return e
+            node = node.child_for(bbox) if node.children else None
+        raise KeyError(item)
+
+    def query(self, bbox):
+        """
+        Query the quadtree for all elements whose bounding box intersects a bounding box
+        Touching edges count as intersecting
+        Does not use recursion
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: A list of elements (maybe empty)
+        """
+        elements = []
+
+        # The root is always checked since it also holds the elements that don't fit in the tree's bbox
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            elements.extend([element for element in node.elements if intersects(element.bbox, bbox)])
+            for child in node.children:
+                if child.count and intersects(child.loose_bbox, bbox):
+                    stack.append(child)
+
+        return elements
+
+    def get_all_bbox(self):
+        all_bbox = []
+        self.root.get_bbox(all_bbox)
+        return all_bbox
+
+    def get_all_elements(self):
+        return list(self.handle_to_element_map.values())
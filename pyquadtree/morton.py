@@ -0,0 +1,57 @@
+"""
+Z-order (Morton) codes of points, used to sort points so that points close together are usually close in the order
+
+A bounding box is split into a grid of 2 ** bits by 2 ** bits cells, and the key of a point is the Morton code of
+its cell, the bits of the cell's column and row interleaved. The order of the quadrants is the same as the children
+of a Node, so every node of a quadtree over the grid is a range of keys
+"""
+
+
+def spread_bits(value):
+    """
+    Put a zero bit between each of the bits of a number of up to 32 bits
+    :param value: The number
+    :return: The number with its bits spread out
+    """
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def interleave(column, row):
+    """
+    The Morton code of a grid cell
+    :param column: The column of the cell
+    :param row: The row of the cell
+    :return: The key
+    """
+    return (spread_bits(column) << 1) | spread_bits(row)
+
+
+def grid_cell(point, bbox, bits):
+    """
+    Find the grid cell of a point, points outside of the bbox are put in the closest cell on its edge
+    Only ever rounds down, so a point that is further right or down is never in an earlier column or row
+    :param point: The point
+    :param bbox: The bounding box of the grid (minx, miny, maxx, maxy)
+    :param bits: The grid has 2 ** bits cells on each side
+    :return: The column and row of the cell
+    """
+    minx, miny, maxx, maxy = bbox
+    cells = 1 << bits
+    column = int((point[0] - minx) * cells / ((maxx - minx) or 1))
+    row = int((point[1] - miny) * cells / ((maxy - miny) or 1))
+    return min(max(column, 0), cells - 1), min(max(row, 0), cells - 1)
+
+
+def morton_key(point, bbox, bits=16):
+    """
+    The position of a point along a Z-order curve over a bounding box
+    :param point: The point, points outside of the bounding box are moved onto its edge
+    :param bbox: The bounding box (minx, miny, maxx, maxy)
+    :param bits: The number of bits of each coordinate, up to 32
+    :return: The key
+    """
+    return interleave(*grid_cell(point, bbox, bits))
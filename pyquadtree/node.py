@@ -2,99 +2,281 @@
 Node class for the quadtree
 Contains the bounding box, elements, and children
 
-Used to store elements and will divide if the number of elements exceeds the max_elements
+Used to store elements and will divide if the number of elements exceeds the tree's max_elements
+The tree wide settings (max_elements and max_depth) are only stored on the QuadTree, which is passed
+to the methods that need them
+
+Nodes from before the tree's last snapshot are shared with the snapshot and are never changed,
+the tree copies them first with QuadTree.own
 """
 
+# The summary of no elements, see summarize
+EMPTY_SUMMARY = (0, 0, None, None)
+
+
+def summarize(elements, field):
+    """
+    Summarize a numeric attribute of the items of some elements
+    :param elements: The elements
+    :param field: The name of the item attribute
+    :return: A tuple of (count, sum, min, max), min and max are None if there are no elements
+    """
+    if not elements:
+        return EMPTY_SUMMARY
+    values = [getattr(element.item, field) for element in elements]
+    return len(values), sum(values), min(values), max(values)
+
+
+def combine_summaries(a, b):
+    """
+    Combine the summaries of two groups of elements
+    :param a: A (count, sum, min, max) summary
+    :param b: Another (count, sum, min, max) summary
+    :return: The summary of both groups
+    """
+    if not a[0]:
+        return b
+    if not b[0]:
+        return a
+    return a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3])
+
 
 class Node:
-    def __init__(self, bbox: tuple, depth, max_elements, max_depth):
+    __slots__ = ("bbox", "elements", "children", "depth", "parent", "count", "summaries", "generation", "arrays")
+
+    def __init__(self, bbox: tuple, depth, parent=None, generation=0):
         """
         :param bbox: tuple with minx, miny, maxx, maxy
+        :param depth: The number of levels above this node
+        :param parent: The node this node is a child of, None for the root
+        :param generation: The number of snapshots the tree had taken when the node was made
         """
         self.bbox = bbox
         self.elements = []
         self.children = []
         self.depth = depth
-        self.max_elements = max_elements
-        self.max_depth = max_depth
+        self.parent = parent
+
+        # The number of elements in this node and all of its descendants
+        self.count = 0
+
+        # Cached summaries of item attributes for this node and all of its descendants, see summary
+        # Reset to None whenever the elements under this node change
+        self.summaries = None
+
+        self.generation = generation
+
+        # NumPy arrays of the coordinates of a leaf's elements, see quadtree.leaf_arrays
+        # Reset to None whenever the leaf's elements or their points change
+        self.arrays = None
+
+    def child_index(self, point):
+        """
+        Find which child a point belongs in
 
-        # Inserts an element into the correct child node
-        self.insert_child = lambda element: self.children[
-            2 * (element[0] > ((self.bbox[0] + self.bbox[2]) / 2)) + (element[1] > ((self.bbox[1] + self.bbox[3]) / 2))
-            ].insert(element)
+        The order of the children is:
+        0 | 2
+        -----
+        1 | 3
 
-        # Deletes an element from the correct child node
-        self.delete_child = lambda element: self.children[
-            2 * (element[0] > ((self.bbox[0] + self.bbox[2]) / 2)) + (element[1] > ((self.bbox[1] + self.bbox[3]) / 2))
-            ].delete(element)
+        :param point: The point to place
+        :return: The index of the child in self.children
+        """
+        return 2 * (point[0] > (self.bbox[0] + self.bbox[2]) / 2) + (point[1] > (self.bbox[1] + self.bbox[3]) / 2)
 
-    def insert(self, element):
+    def insert(self, element, tree):
         """
         Insert an element into the node
         Will split the node if it has too many elements
         :param element: The element to store
+        :param tree: The QuadTree this node belongs to
+        """
+        node = tree.own(self)
+        node.count += 1
+        node.summaries = None
+        while node.children:
+            node = node.children[node.child_index(element.point)]
+            if node.generation != tree.generation:
+                node = tree.own(node)
+            node.count += 1
+            node.summaries = None
+
+        element.node = node
+        element.index = len(node.elements)
+        node.elements.append(element)
+        node.arrays = None
+        if len(node.elements) > tree.max_elements and node.depth < tree.max_depth:
+            node.split(tree)
+
+    def bulk_insert(self, elements, tree):
+        """
+        Insert many elements at once
+        The elements are partitioned by quadrant from the top down, so every node is only created once
+        instead of being split again and again as the elements arrive one at a time
+        The node must not be shared with a snapshot, see QuadTree.own
+        :param elements: A list of the elements to store
+        :param tree: The QuadTree this node belongs to
         """
+        self.count += len(elements)
+        self.summaries = None
+        self.arrays = None
+
         if not self.children:
-            self.elements.append(element)
-            if len(self.elements) > self.max_elements and self.depth < self.max_depth:
-                self.split()
-        else:
-            # Child insert
-            self.insert_child(element)
+            elements = self.elements + elements
+            if len(elements) <= tree.max_elements or self.depth >= tree.max_depth:
+                self.elements = elements
+                for index, element in enumerate(elements):
+                    element.node = self
+                    element.index = index
+                return
+            self.elements = []
+            self.split(tree)
+
+        midx = (self.bbox[0] + self.bbox[2]) / 2
+        midy = (self.bbox[1] + self.bbox[3]) / 2
+
+        # Same order as the children
+        quadrants = ([], [], [], [])
+        for element in elements:
+            x, y = element.point
+            quadrants[2 * (x > midx) + (y > midy)].append(element)
+
+        for child, quadrant in zip(self.children, quadrants):
+            if quadrant:
+                tree.own(child).bulk_insert(quadrant, tree)
 
-    def delete(self, element):
+    def remove(self, element, top):
         """
-        Delete an element from the node
-        If it doesn't have this element, then it checks a child node
-        :param element: The element to delete
+        Remove an element from this leaf node in O(1)
+        The last element is moved into the removed element's place, so the order of the elements changes
+        Call merge_up afterwards to merge the ancestors that no longer have too many elements
+        The node must not be shared with a snapshot, see QuadTree.own
+        :param element: The element to remove, must be stored in this node
+        :param top: The highest ancestor that no longer holds the element, the counts of the nodes from this
+                    node up to top are updated
+        """
+        last = self.elements.pop()
+        if last is not element:
+            self.elements[element.index] = last
+            last.index = element.index
+        element.node = None
+        self.arrays = None
+
+        node = self
+        while True:
+            node.count -= 1
+            node.summaries = None
+            if node is top:
+                break
+            node = node.parent
 
-        :return: True if the element was deleted, False otherwise
+    def merge_up(self, tree):
         """
-        if not self.children:
-            for e in self.elements:
-                if e == element:
-                    self.elements.remove(element)
-                    return True
-        else:
-            if self.delete_child(element):
-                count = 0  # How many elements are in my children
-                for child in self.children:
-                    if not child.children:
-                        count += len(child.elements)
-                    else:
-                        # If any of my children have children, then there must be too many elements
-                        return False
-                if count <= self.max_elements:
-                    self.merge()
-
-    def split(self):
+        Merge my ancestors, starting with my parent, for as long as all the elements of their children fit in them
+        :param tree: The QuadTree this node belongs to
+        """
+        node = self.parent
+        while node is not None and node.should_merge(tree):
+            node.merge(tree)
+            node = node.parent
+
+    def should_merge(self, tree):
+        """
+        Check if my children have few enough elements to be merged back into me
+        :param tree: The QuadTree this node belongs to
+        :return: True if the node should be merged, False otherwise
+        """
+        count = 0  # How many elements are in my children
+        for child in self.children:
+            if child.children:
+                # If any of my children have children, then there must be too many elements
+                return False
+            count += len(child.elements)
+        return count <= tree.merge_threshold
+
+    def split(self, tree):
         """
         Split the node into four sub-nodes
+        :param tree: The QuadTree this node belongs to
         """
         minx, miny, maxx, maxy = self.bbox
         midx = (minx + maxx) / 2
         midy = (miny + maxy) / 2
+        depth = self.depth + 1
 
-        self.children = []
-
-        self.children.append(Node((minx, miny, midx, midy), self.depth + 1, self.max_elements, self.max_depth))
-        self.children.append(Node((minx, midy, midx, maxy), self.depth + 1, self.max_elements, self.max_depth))
-        self.children.append(Node((midx, miny, maxx, midy), self.depth + 1, self.max_elements, self.max_depth))
-        self.children.append(Node((midx, midy, maxx, maxy), self.depth + 1, self.max_elements, self.max_depth))
+        self.children = [tree.new_node((minx, miny, midx, midy), depth, self),
+                         tree.new_node((minx, midy, midx, maxy), depth, self),
+                         tree.new_node((midx, miny, maxx, midy), depth, self),
+                         tree.new_node((midx, midy, maxx, maxy), depth, self)]
+        tree.split_count += 1
+        stats = tree._stats()
+        if stats is not None:
+            stats.splits += 1
 
         for element in self.elements:
             # Child insert
-            self.insert_child(element)
+            self.children[2 * (element.point[0] > midx) + (element.point[1] > midy)].insert(element, tree)
         self.elements = []
+        self.arrays = None
 
-    def merge(self):
+    def merge(self, tree):
         """
         Take all the elements from my children and add them to me
-        Also remove my children
+        Also remove my children, they are given back to the tree to be reused
+        :param tree: The QuadTree this node belongs to
         """
         for child in self.children:
             self.elements.extend(child.elements)
+            # Children shared with a snapshot are left alone, they are never reused
+            if child.generation == tree.generation:
+                child.elements.clear()
+                child.count = 0
+        tree.recycle_nodes(self.children)
         self.children = []
+        self.arrays = None
+        tree.merge_count += 1
+        stats = tree._stats()
+        if stats is not None:
+            stats.merges += 1
+
+        for index, element in enumerate(self.elements):
+            element.node = self
+            element.index = index
+
+    def summary(self, field):
+        """
+        Summarize a numeric attribute of the items in this node and all of its descendants
+        The summary is cached until the elements under this node change
+        :param field: The name of the item attribute
+        :return: A tuple of (count, sum, min, max), min and max are None if there are no elements
+        """
+        if self.summaries is None:
+            self.summaries = {}
+        elif field in self.summaries:
+            return self.summaries[field]
+
+        if not self.children:
+            summary = summarize(self.elements, field)
+        else:
+            summary = EMPTY_SUMMARY
+            for child in self.children:
+                summary = combine_summaries(summary, child.summary(field))
+
+        self.summaries[field] = summary
+        return summary
+
+    def get_elements(self, all_elements):
+        """
+        Add the elements of this node and all of its descendants to a list
+        :param all_elements: The list to add the elements to
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(node.children)
+            else:
+                all_elements.extend(node.elements)
 
     def get_bbox(self, all_bbox):
         all_bbox += [self.bbox]
@@ -0,0 +1,158 @@
+"""
+Run big batches of queries and nearest neighbor searches on a pool of processes
+
+The tree is frozen and put in shared memory once, and every worker process attaches to it when it starts,
+so only the batches and the results are sent between the processes.
+The batches are sorted along a Z-order curve before they are split into chunks, so each worker gets
+queries that are close together and keep visiting the same part of the tree.
+The workers only send back the indices of the elements they found, the elements are made by the calling process,
+or the workers send back the handles of the elements and no elements are made at all
+"""
+
+import multiprocessing
+import multiprocessing.util
+from array import array
+
+from .frozen_quadtree import FrozenQuadTree, paused_gc
+from .morton import morton_key
+from .quadtree import neighbors_result
+
+# The tree of the worker process, set by attach_worker when the worker starts
+worker_tree = None
+
+
+def attach_worker(name):
+    """
+    Attach the worker process to the shared tree
+    :param name: The name of the shared memory block of the tree
+    """
+    global worker_tree
+    # The workers share the resource tracker of the process that made the block, unregistering would unregister it
+    # for that process too
+    worker_tree = FrozenQuadTree.attach(name, track=True)
+    # Closed when the worker exits, the shared memory can't be closed by its own finalizer while the tree uses it
+    multiprocessing.util.Finalize(worker_tree, worker_tree.close, exitpriority=0)
+
+
+def query_chunk(chunk):
+    """
+    Run a chunk of queries in a worker process
+    :param chunk: A tuple of (positions, bboxes, handles), where positions are the indices of the bboxes in the batch
+                  and handles is True to find the handles of the elements instead of their indices
+    :return: A tuple of (positions, results), each result is an array of element indices or handles
+    """
+    positions, bboxes, handles = chunk
+    if handles:
+        tree_handles = worker_tree.handles
+        return positions, [array("q", [tree_handles[i] for i in worker_tree._query_indices(bbox)]) for bbox in bboxes]
+    return positions, [array("q", worker_tree._query_indices(bbox)) for bbox in bboxes]
+
+
+def nearest_chunk(chunk):
+    """
+    Run a chunk of nearest neighbor searches in a worker process
+    :param chunk: A tuple of (positions, points, number_of_neighbors, bound_sq, condition)
+    :return: A tuple of (positions, results), each result is a list of (distance_sq, element index)
+    """
+    positions, points, number_of_neighbors, bound_sq, condition = chunk
+    return positions, [worker_tree._nearest(point, number_of_neighbors, bound_sq, condition) for point in points]
+
+
+class ParallelQueryExecutor:
+    """
+    Runs batches of queries and nearest neighbor searches on a pool of processes
+    The tree is copied when the executor is made, later changes to it aren't seen
+    Close the executor when it is no longer needed to stop the processes and free the shared memory
+    """
+
+    def __init__(self, qtree, processes=None, chunk_size=None, context=None):
+        """
+        :param qtree: The QuadTree or FrozenQuadTree to query
+        :param processes: The number of worker processes, defaults to the number of CPUs
+        :param chunk_size: The number of queries sent to a worker at a time
+                           Defaults to splitting each batch into 4 chunks per process
+        :param context: The multiprocessing start method, e.g. "spawn", defaults to the platform's default
+        """
+        frozen = qtree if isinstance(qtree, FrozenQuadTree) else qtree.freeze()
+        self.tree = frozen.to_shared_memory()
+
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.pool = multiprocessing.get_context(context).Pool(self.processes, attach_worker, (self.tree.name,))
+
+    def _chunks(self, points):
+        """
+        Sort a batch along a Z-order curve and split it into chunks
+        :param points: The point of each query in the batch, used to sort it
+        :return: A list with the positions in the batch of the queries in each chunk
+        """
+        bbox = self.tree.root_bbox
+        order = sorted(range(len(points)), key=lambda position: morton_key(points[position], bbox))
+
+        chunk_size = self.chunk_size or max(1, -(-len(order) // (self.processes * 4)))
+        return [order[start:start + chunk_size] for start in range(0, len(order), chunk_size)]
+
+    def query_many(self, bboxes, handles=False):
+        """
+        Query the tree with many bounding boxes, see QuadTree.query
+        :param bboxes: A sequence of bounding boxes (minx, miny, maxx, maxy)
+        :param handles: If True, an array('q') of the handles of the elements is returned for each bounding box,
+                        and no elements are made, which is much faster for big results
+                        The handles are the ones of the QuadTree the executor was made with
+        :return: A list with the list of elements within each bounding box, in the same order as bboxes
+        """
+        bboxes = list(bboxes)
+        centers = [((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2) for bbox in bboxes]
+        chunks = [(positions, [bboxes[position] for position in positions], handles)
+                  for positions in self._chunks(centers)]
+
+        results = [None] * len(bboxes)
+        with paused_gc():
+            for positions, found in self.pool.imap_unordered(query_chunk, chunks):
+                for position, indices in zip(positions, found):
+                    results[position] = indices if handles else self.tree.elements(indices)
+        return results
+
+    def nearest_neighbors_many(self, points, condition=None, max_distance=float('inf'),
+                               number_of_neighbors=1, return_distances=False):
+        """
+        Find the nearest neighbors of many points, see QuadTree.nearest_neighbors
+        :param points: A sequence of points
+        :param condition: A function that takes in an item and returns True if it should be considered
+                          It is sent to the workers, so it has to be picklable, e.g. a function defined in a module
+        :param max_distance: The maximum distance to search for a point
+        :param number_of_neighbors: The number of neighbors to find for each point
+        :param return_distances: If True, lists of (element, distance) tuples are returned instead
+        :return: A list with the list of nearest neighbors of each point, in the same order as points
+        """
+        points = [tuple(point) for point in points]
+        if number_of_neighbors < 1:
+            return [[] for _ in points]
+
+        chunks = [(positions, [points[position] for position in positions], number_of_neighbors,
+                   max_distance ** 2, condition)
+                  for positions in self._chunks(points)]
+
+        results = [None] * len(points)
+        with paused_gc():
+            for positions, found in self.pool.imap_unordered(nearest_chunk, chunks):
+                for position, neighbors in zip(positions, found):
+                    elements = self.tree.elements([i for _, i in neighbors])
+                    results[position] = neighbors_result([(distance_sq, element) for (distance_sq, _), element
+                                                          in zip(neighbors, elements)], return_distances)
+        return results
+
+    def close(self):
+        """
+        Stop the worker processes and free the shared memory
+        """
+        self.pool.close()
+        self.pool.join()
+        self.tree.close()
+        self.tree.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,5 +1,20 @@
+import random
+from array import array
 from collections import deque
-from .node import Node
+from heapq import heappop, heappush, heapreplace
+from math import inf, sqrt
+from time import perf_counter
+from .instrumentation import instrumented
+from .node import Node, EMPTY_SUMMARY, summarize, combine_summaries
+
+# NumPy is optional, it is only used by trees made with backend="numpy"
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Leaves with fewer elements than this are always compared in Python, NumPy's overhead per call is bigger than the loop
+VECTORIZE_MIN_ELEMENTS = 64
 
 
 def distance_sq_to_bbox(point, bbox):
@@ -55,18 +70,267 @@ def distance_sq_to_bbox(point, bbox):
     return distance_sq
 
 
+def distance_sq_between_bboxes(a, b):
+    """
+    Calculate the distance squared between the closest points of two bounding boxes
+    Will return 0 if the bounding boxes overlap or touch
+    :param a: A bounding box
+    :param b: Another bounding box
+    :return: The distance squared
+    """
+    # The gap along each axis, which is negative if the boxes overlap along that axis
+    dx = max(a[0] - b[2], b[0] - a[2], 0)
+    dy = max(a[1] - b[3], b[1] - a[3], 0)
+    return dx * dx + dy * dy
+
+
+def close_leaf_pairs(a, b, distance_sq, stats=None):
+    """
+    Walk two trees together to find the pairs of leaf nodes that could have elements within a distance of each other
+    If both roots are the same node, each unordered pair of leaves is only found once and a leaf is also paired
+    with itself
+    :param a: The root of one tree
+    :param b: The root of the other tree, or the same root
+    :param distance_sq: The maximum distance squared between elements
+    :param stats: The OperationStats to count the work in, or None
+    :return: Generator of (leaf, leaf) tuples, the first leaf is from a's tree and the second from b's tree
+    """
+    # Elements outside of a tree's bbox are kept in the nodes on its edge, so those nodes reach out to infinity
+    a_root_bbox = a.bbox
+    b_root_bbox = b.bbox
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if stats is not None:
+            stats.nodes_visited += 1 if a is b else 2
+        if a is b:
+            if a.children:
+                children = [child for child in a.children if child.count]
+                for i, child in enumerate(children):
+                    stack.append((child, child))
+                    for other in children[i + 1:]:
+                        if stats is not None:
+                            stats.distance_computations += 1
+                        if distance_sq_between_bboxes(edge_bbox(child.bbox, a_root_bbox),
+                                                      edge_bbox(other.bbox, a_root_bbox)) <= distance_sq:
+                            stack.append((child, other))
+                        elif stats is not None:
+                            stats.nodes_pruned += 1
+            else:
+                yield a, b
+
+        elif a.children or b.children:
+            # Splitting the bigger node of the two
+            a_size = a.bbox[2] - a.bbox[0] + a.bbox[3] - a.bbox[1]
+            b_size = b.bbox[2] - b.bbox[0] + b.bbox[3] - b.bbox[1]
+            if a.children and (not b.children or a_size >= b_size):
+                pairs = [(child, b) for child in a.children if child.count]
+            else:
+                pairs = [(a, child) for child in b.children if child.count]
+            if stats is not None:
+                stats.distance_computations += len(pairs)
+            for pair in pairs:
+                if distance_sq_between_bboxes(edge_bbox(pair[0].bbox, a_root_bbox),
+                                              edge_bbox(pair[1].bbox, b_root_bbox)) <= distance_sq:
+                    stack.append(pair)
+                elif stats is not None:
+                    stats.nodes_pruned += 1
+
+        elif a.elements and b.elements:
+            yield a, b
+
+
+def close_element_pairs(a, b, distance_sq, stats=None):
+    """
+    Compare the elements of two different leaf nodes
+    :param a: A leaf node
+    :param b: Another leaf node
+    :param distance_sq: The maximum distance squared between elements
+    :param stats: The OperationStats to count the work in, or None
+    :return: Generator of (element of a, element of b) tuples within the distance of each other
+    """
+    if stats is not None:
+        stats.distance_computations += len(a.elements) * len(b.elements)
+    for e in a.elements:
+        x, y = e.point
+        for other in b.elements:
+            dx = x - other.point[0]
+            dy = y - other.point[1]
+            if dx * dx + dy * dy <= distance_sq:
+                yield e, other
+
+
+def max_distance_sq_to_bbox(point, bbox):
+    """
+    Calculate the distance squared from a point to the furthest corner of the bounding box
+    :param point: The point
+    :param bbox: The bounding box
+    :return: The distance squared
+    """
+    minx, miny, maxx, maxy = bbox
+    x, y = point
+    dx = max(x - minx, maxx - x)
+    dy = max(y - miny, maxy - y)
+    return dx * dx + dy * dy
+
+
+def touches_edge(node_bbox, root_bbox):
+    """
+    Check if a node is on the edge of the tree
+    These nodes also hold the points outside of the tree's bbox, so their bbox doesn't bound their elements
+    :param node_bbox: The bounding box of the node
+    :param root_bbox: The bounding box of the root node
+    :return: True if any side of the node is on a side of the root
+    """
+    return (node_bbox[0] == root_bbox[0] or node_bbox[1] == root_bbox[1] or
+            node_bbox[2] == root_bbox[2] or node_bbox[3] == root_bbox[3])
+
+
+def edge_bbox(node_bbox, root_bbox):
+    """
+    The area a node's elements can be in, its bbox grown forever past the sides it shares with the root
+    Nodes on the edge of the tree also hold the points outside of the tree's bbox
+    :param node_bbox: The bounding box of the node
+    :param root_bbox: The bounding box of the root node
+    :return: The bounding box (minx, miny, maxx, maxy), its sides on the tree's edge are infinite
+    """
+    return (-inf if node_bbox[0] == root_bbox[0] else node_bbox[0],
+            -inf if node_bbox[1] == root_bbox[1] else node_bbox[1],
+            inf if node_bbox[2] == root_bbox[2] else node_bbox[2],
+            inf if node_bbox[3] == root_bbox[3] else node_bbox[3])
+
+
+def contains_node(bbox, node_bbox, root_bbox):
+    """
+    Check if every point that a node can hold is within a bounding box
+    :param bbox: The bounding box (minx, miny, maxx, maxy), the max edges are exclusive
+    :param node_bbox: The bounding box of the node
+    :param root_bbox: The bounding box of the root node
+    :return: True if the node is fully contained, False otherwise
+    """
+    minx, miny, maxx, maxy = bbox
+    nminx, nminy, nmaxx, nmaxy = node_bbox
+
+    # A node holds the points on its max edges, so they have to be strictly inside the bounding box
+    # Nodes on the edges of the tree can't be contained since they also hold the points outside of the tree's bbox
+    return (minx <= nminx and nmaxx < maxx and miny <= nminy and nmaxy < maxy and
+            not touches_edge(node_bbox, root_bbox))
+
+
+def leaf_arrays(leaf):
+    """
+    The x and y coordinates of the elements of a leaf node as NumPy arrays, in the same order as its elements
+    They are made when first needed and kept until the leaf's elements or their points change
+    :param leaf: The leaf node
+    :return: A tuple of (xs, ys)
+    """
+    if leaf.arrays is None:
+        points = numpy.array([element.point for element in leaf.elements], dtype=float).reshape(-1, 2)
+        leaf.arrays = numpy.ascontiguousarray(points[:, 0]), numpy.ascontiguousarray(points[:, 1])
+    return leaf.arrays
+
+
+def filter_leaf(leaf, bbox, root_bbox, vectorize=False):
+    """
+    Find the elements of a leaf node that are within a bounding box
+    Only the axes where the leaf sticks out of the bounding box are compared,
+    so a leaf that is fully inside the bounding box doesn't compare any elements
+    :param leaf: The leaf node
+    :param bbox: The bounding box (minx, miny, maxx, maxy), the max edges are exclusive
+    :param root_bbox: The bounding box of the root node
+    :param vectorize: If True, big leaves are compared with NumPy, see QuadTree's backend
+    :return: A list of the elements within the bounding box
+    """
+    minx, miny, maxx, maxy = bbox
+    nminx, nminy, nmaxx, nmaxy = leaf.bbox
+    rminx, rminy, rmaxx, rmaxy = root_bbox
+
+    # Points outside of the tree's bbox are stored in the nodes along its edges,
+    # so a node's bbox on those edges doesn't bound its elements
+    check_x = not (minx <= nminx and nmaxx < maxx) or nminx == rminx or nmaxx == rmaxx
+    check_y = not (miny <= nminy and nmaxy < maxy) or nminy == rminy or nmaxy == rmaxy
+
+    if vectorize and (check_x or check_y) and len(leaf.elements) >= VECTORIZE_MIN_ELEMENTS:
+        xs, ys = leaf_arrays(leaf)
+        if check_x and check_y:
+            mask = (xs >= minx) & (xs < maxx) & (ys >= miny) & (ys < maxy)
+        elif check_x:
+            mask = (xs >= minx) & (xs < maxx)
+        else:
+            mask = (ys >= miny) & (ys < maxy)
+        elements = leaf.elements
+        return [elements[i] for i in numpy.flatnonzero(mask).tolist()]
+
+    if check_x and check_y:
+        return [element for element in leaf.elements if
+                minx <= element.point[0] < maxx and miny <= element.point[1] < maxy]
+    if check_x:
+        return [element for element in leaf.elements if minx <= element.point[0] < maxx]
+    if check_y:
+        return [element for element in leaf.elements if miny <= element.point[1] < maxy]
+    return leaf.elements
+
+
+def neighbors_result(found, return_distances):
+    """
+    Convert the (distance_sq, element) list from a nearest neighbor search into what is returned to the user
+    :param found: A list of (distance_sq, element)
+    :param return_distances: If True, return (element, distance) tuples instead of elements
+    :return: A list of elements or (element, distance) tuples
+    """
+    if return_distances:
+        return [(e, sqrt(distance_sq)) for distance_sq, e in found]
+    return [e for _, e in found]
+
+
+def build_from_points(tree_class, points, items, bbox, *args, **kwargs):
+    """
+    Make a tree and add many points to it at once with add_many, see QuadTree.from_points
+    :param tree_class: The class of the tree
+    :param points: A sequence of (x, y) points
+    :param items: A sequence of the items stored at each point, or None for the index of each point
+    :param bbox: The bounding box of the tree, or None for the bounding box of the points
+    :param args: The other arguments for the tree after its bbox
+    :param kwargs: The other keyword arguments for the tree
+    :return: The new tree
+    """
+    points = [tuple(point) for point in points]
+    if items is None:
+        items = range(len(points))
+
+    if bbox is None:
+        if not points:
+            raise ValueError("A bbox is needed to build a quadtree without any points")
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+
+    qtree = tree_class(bbox, *args, **kwargs)
+    qtree.add_many(items, points)
+    return qtree
+
+
 class Element:
     """
     A wrapper class for an element to be stored in the quadtree
     """
+    __slots__ = ("item", "point", "handle", "node", "index", "generation")
 
-    def __init__(self, item, point: tuple):
+    def __init__(self, item, point: tuple, handle=None, generation=0):
         """
         :param item: Any object to be stored at a location
         :param point: The location of the item object
+        :param handle: The integer handle given to the element by the quadtree
+        :param generation: The number of snapshots the tree had taken when the element was made
         """
         self.item = item
         self.point = point
+        self.handle = handle
+        self.generation = generation
+
+        # The leaf node the element is stored in and its index in that node's elements
+        self.node = None
+        self.index = None
 
     def __getitem__(self, index):
         """
@@ -83,48 +347,517 @@ class Element:
 
 
 class QuadTree:
-    def __init__(self, bbox: tuple, max_elements=10, max_depth=10):
+    def __init__(self, bbox: tuple, max_elements=10, max_depth=10, track_items=True, merge_threshold=None,
+                 node_pool_size=0, auto_expand=False, backend="python"):
         """
         :param bbox: The bounding box of the entire quadtree
         :param max_elements: The maximum number of points in a node before it splits
         :param max_depth: The maximum number of levels in the tree
+        :param track_items: If True, item_to_point_map is kept so items can be deleted by the item itself
+                            If False, items don't need to be hashable but can only be deleted by their handle
+        :param merge_threshold: A node's children are merged back into it once they have this many elements or less
+                                Defaults to max_elements, a lower value stops a node from being split and merged
+                                over and over when the number of elements goes back and forth around max_elements
+        :param node_pool_size: The maximum number of merged away nodes kept around to be reused by splits
+        :param auto_expand: If True, the root grows to fit points outside of its bbox and shrinks back when all the
+                            elements are in one of its children. max_depth changes along with it, so the smallest
+                            nodes stay the same size
+        :param backend: "python", or "numpy" to compare the elements of big leaves with NumPy arrays
+                        Helps when many points end up in the same leaves, e.g. dense areas at max_depth or a big
+                        max_elements. The arrays of a leaf are made again after its elements change, so it suits
+                        trees that are queried more than they are changed. Needs NumPy to be installed
         """
+        if backend not in ("python", "numpy"):
+            raise ValueError('backend has to be "python" or "numpy"')
+        if backend == "numpy" and numpy is None:
+            raise ImportError('backend="numpy" needs NumPy to be installed')
+        if merge_threshold is None:
+            merge_threshold = max_elements
+        if merge_threshold > max_elements:
+            raise ValueError("merge_threshold can't be more than max_elements")
 
         # Maps for quick lookup of items and points by the other
         # Can be used to update the quadtree if the point of an item changes
         # or if the item of a point changes
         self.item_to_point_map = {}
+        self.track_items = track_items
+
+        # Every element gets an integer handle when it is added
+        # The element knows which leaf it is in, so it can be deleted without searching the tree
+        self.handle_to_element_map = {}
+        self.next_handle = 0
 
         self.max_elements = max_elements
         self.max_depth = max_depth
+        self.merge_threshold = merge_threshold
+
+        # Nodes that were merged away, reused by splits instead of creating new nodes
+        self.node_pool = []
+        self.node_pool_size = node_pool_size
+
+        # How many times nodes have been split and merged
+        self.split_count = 0
+        self.merge_count = 0
+
+        self.auto_expand = auto_expand
+
+        # True if big leaves are compared with NumPy, see leaf_arrays
+        self.vectorize = backend == "numpy"
+
+        # The number of snapshots taken, nodes from an older generation are shared with a snapshot
+        self.generation = 0
 
-        self.root = Node(bbox, depth=0, max_elements=max_elements, max_depth=max_depth)
+        self.root = Node(bbox, depth=0)
 
-        self.debug_elements_checked = []
+        # Set to an Instrumentation to count the work done by each operation, see instrumentation.py
+        self.instrumentation = None
 
+    @instrumented
     def add(self, item, point: tuple):
         """
         Insert an item into the quadtree at the location specified by point
         :param item: The item to store which can be any object
         :param point: A tuple with the x and y coordinate for the item
+        :return: The integer handle of the new element, can be used to delete it
         """
-        new_element = Element(item, point)
+        new_element = Element(item, point, self.next_handle, self.generation)
+        self.handle_to_element_map[self.next_handle] = new_element
+        self.next_handle += 1
 
-        self.item_to_point_map[item] = point
+        if self.track_items:
+            self.item_to_point_map[item] = point
 
-        return self.root.insert(new_element)
+        if self.auto_expand:
+            self._expand_to(point)
+        self.root.insert(new_element, self)
+        return new_element.handle
 
-    def delete(self, item):
+    @classmethod
+    def from_points(cls, points, items=None, bbox=None, max_elements=10, max_depth=10, **kwargs):
+        """
+        Build a quadtree from many points at once
+        Much faster than calling add for each point since the tree is built from the top down
+        :param points: A sequence of (x, y) points, the rows of a NumPy array also work
+        :param items: A sequence of the items stored at each point, defaults to the index of each point
+        :param bbox: The bounding box of the entire quadtree, defaults to the bounding box of the points
+        :param max_elements: The maximum number of points in a node before it splits
+        :param max_depth: The maximum number of levels in the tree
+        :param kwargs: Any other arguments for the QuadTree, e.g. track_items
+        :return: The new quadtree, the handle of each element is the index of its point
+        """
+        return build_from_points(cls, points, items, bbox, max_elements, max_depth, **kwargs)
+
+    @instrumented
+    def add_many(self, items, points):
+        """
+        Insert many items into the quadtree at once
+        The new elements are partitioned by quadrant from the top down instead of being added one at a time
+        :param items: A sequence of the items to store
+        :param points: A sequence of (x, y) points, one for each item
+        :return: A list of the integer handles of the new elements
+        """
+        new_elements = []
+        for item, point in zip(items, points):
+            point = tuple(point)
+            new_element = Element(item, point, self.next_handle, self.generation)
+            self.handle_to_element_map[self.next_handle] = new_element
+            self.next_handle += 1
+            new_elements.append(new_element)
+            if self.track_items:
+                self.item_to_point_map[item] = point
+            if self.auto_expand:
+                self._expand_to(point)
+
+        self.own(self.root).bulk_insert(new_elements, self)
+        return [element.handle for element in new_elements]
+
+    @instrumented
+    def delete(self, item=None, handle=None):
         """
         Delete an item from the quadtree
         Will restructure the quadtree if necessary, i.e. a parent node has less than max_elements
+        Deleting by handle is O(1) and never compares items, deleting by item has to search the item's leaf
         :param item: The item to delete
+        :param handle: The handle returned by add, used instead of the item
         """
-        point = self.item_to_point_map[item]
-        element = Element(item, point)
-        del self.item_to_point_map[item]
-        self.root.delete(element)
+        if handle is not None:
+            element = self.handle_to_element_map.pop(handle)
+        else:
+            if not self.track_items:
+                raise ValueError("Items are not tracked, delete by handle instead")
+            element = self._find_element(item, self.item_to_point_map[item])
+            del self.handle_to_element_map[element.handle]
+        # An item added more than once is only mapped to the point it was added or moved to last
+        if self.track_items and self.item_to_point_map.get(element.item) == element.point:
+            del self.item_to_point_map[element.item]
+
+        leaf = self.own(element.node)
+        leaf.remove(element, self.root)
+        leaf.merge_up(self)
+        if self.auto_expand:
+            self._shrink()
 
+    @instrumented
+    def move(self, item=None, new_point=None, handle=None):
+        """
+        Move an item to a new point
+        If the new point is in the same leaf node, the element is updated in place
+        Otherwise it is only moved up to the lowest node containing both points before being inserted again
+        :param item: The item to move
+        :param new_point: A tuple with the new x and y coordinate for the item
+        :param handle: The handle returned by add, used instead of the item
+        """
+        if handle is None and not self.track_items:
+            raise ValueError("Items are not tracked, move by handle instead")
+
+        # Growing the root can replace elements, so they are looked up afterwards
+        if self.auto_expand:
+            self._expand_to(new_point)
+
+        if handle is not None:
+            element = self.handle_to_element_map[handle]
+        else:
+            element = self._find_element(item, self.item_to_point_map[item])
+
+        if self.track_items:
+            self.item_to_point_map[element.item] = new_point
+        self._move_element(element, new_point)
+        if self.auto_expand:
+            self._shrink()
+
+    @instrumented
+    def update_many(self, items=None, points=None, handles=None, rebuild_threshold=0.5):
+        """
+        Move many items to new points at once
+        Elements that stay in their leaf node are updated in place. If more than rebuild_threshold of all the
+        elements in the tree change leaf nodes, the whole tree is rebuilt from the top down instead
+        :param items: A sequence of the items to move
+        :param points: A sequence of the new points, one for each item
+        :param handles: A sequence of handles returned by add, used instead of the items
+        :param rebuild_threshold: The fraction of the tree's elements that have to change leaf nodes for a rebuild
+        """
+        if handles is None and not self.track_items:
+            raise ValueError("Items are not tracked, move by handle instead")
+
+        # Growing the root can replace elements, so they are looked up afterwards
+        if self.auto_expand:
+            points = list(points)
+            for point in points:
+                self._expand_to(point)
+
+        if handles is not None:
+            elements = [self.handle_to_element_map[handle] for handle in handles]
+        else:
+            elements = [self._find_element(item, self.item_to_point_map[item]) for item in items]
+
+        # The elements that are staying in their leaf can be updated right away since the tree doesn't change
+        leaving = []
+        for element, point in zip(elements, points):
+            if self.track_items:
+                self.item_to_point_map[element.item] = point
+            if self._lowest_common_ancestor(element.node, point) is None:
+                element = self._writable_element(element)
+                element.point = point
+                element.node.arrays = None
+            else:
+                leaving.append((element, point))
+
+        if len(leaving) > rebuild_threshold * len(self.handle_to_element_map):
+            for element, point in leaving:
+                self._writable_element(element).point = point
+            self._rebuild()
+        else:
+            for element, point in leaving:
+                self._move_element(element, point)
+
+        if self.auto_expand:
+            self._shrink()
+
+    def _move_element(self, element, new_point):
+        """
+        Move an element to a new point, see move
+        :param element: The element to move
+        :param new_point: The new point
+        """
+        element = self._writable_element(element)
+        ancestor = self._lowest_common_ancestor(element.node, new_point)
+        element.point = new_point
+        if ancestor is None:
+            element.node.arrays = None
+            return
+
+        # The old leaf isn't merged until the element has been inserted again,
+        # otherwise the ancestor could be merged away before the insert
+        old_leaf = self.own(element.node)
+        old_leaf.remove(element, ancestor)
+        ancestor.insert(element, self)
+        old_leaf.merge_up(self)
+
+    def _lowest_common_ancestor(self, leaf, point):
+        """
+        Find the lowest node that contains both a leaf node and a point
+        :param leaf: The leaf node
+        :param point: The point
+        :return: The node, or None if the point belongs in the leaf itself
+        """
+        minx, miny, maxx, maxy = leaf.bbox
+        if minx < point[0] < maxx and miny < point[1] < maxy:
+            # Points strictly inside the leaf's bbox always belong to it
+            return None
+
+        # Climbing up to the root, remembering the highest node where the point would go to a different child
+        ancestor = None
+        node = leaf
+        while node.parent is not None:
+            parent = node.parent
+            if parent.children[parent.child_index(point)] is not node:
+                ancestor = parent
+            node = parent
+        return ancestor
+
+    def new_node(self, bbox, depth, parent):
+        """
+        Create a node for this tree, reusing one from the node pool if there are any
+        :param bbox: tuple with minx, miny, maxx, maxy
+        :param depth: The number of levels above the node
+        :param parent: The node the new node is a child of
+        :return: The node
+        """
+        if self.node_pool:
+            node = self.node_pool.pop()
+            node.bbox = bbox
+            node.depth = depth
+            node.parent = parent
+            node.elements = []
+            node.children = []
+            node.count = 0
+            node.summaries = None
+            node.arrays = None
+            node.generation = self.generation
+            return node
+        return Node(bbox, depth, parent, self.generation)
+
+    def recycle_nodes(self, nodes):
+        """
+        Put nodes that are no longer in the tree into the node pool, as long as it isn't full
+        Nodes shared with a snapshot are skipped, since the snapshot still uses them
+        :param nodes: Empty nodes that have been removed from the tree
+                      A pooled node's children are dropped when it is reused
+        """
+        for node in nodes:
+            if len(self.node_pool) >= self.node_pool_size:
+                return
+            if node.generation == self.generation:
+                node.parent = None
+                self.node_pool.append(node)
+
+    def _stats(self):
+        """
+        :return: The OperationStats of the operation in progress, or None if the tree isn't instrumented
+        """
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.current()
+
+    def own(self, node):
+        """
+        Get a node that can be changed without changing any snapshot
+        A node shared with a snapshot is replaced in the tree by a copy, along with all of its ancestors,
+        so only the path from the root to the node is copied and the rest of the tree is still shared
+        :param node: A node in the tree
+        :return: The node itself, or its copy if it was shared
+        """
+        if node.generation == self.generation:
+            return node
+
+        copy = Node(node.bbox, node.depth, None, self.generation)
+        copy.elements = list(node.elements)
+        copy.arrays = node.arrays
+        copy.children = list(node.children)
+        copy.count = node.count
+
+        if node.parent is None:
+            self.root = copy
+        else:
+            parent = self.own(node.parent)
+            parent.children[parent.children.index(node)] = copy
+            copy.parent = parent
+
+        # Snapshots never use the parents of nodes or the nodes of elements, so these can be changed in place
+        for child in copy.children:
+            child.parent = copy
+        for element in copy.elements:
+            element.node = copy
+        return copy
+
+    def _writable_element(self, element):
+        """
+        Get an element whose point can be changed without changing any snapshot
+        An element made before the last snapshot is shared with it,
+        so it is replaced by a copy in its leaf and in handle_to_element_map
+        :param element: An element in the tree
+        :return: The element itself, or its copy
+        """
+        if element.generation == self.generation:
+            return element
+
+        leaf = self.own(element.node)
+        copy = Element(element.item, element.point, element.handle, self.generation)
+        copy.node = leaf
+        copy.index = element.index
+        leaf.elements[element.index] = copy
+        self.handle_to_element_map[element.handle] = copy
+        return copy
+
+    def snapshot(self):
+        """
+        Take a read-only view of the tree as it is now, which later changes to the tree don't affect
+        Takes O(1) time, the tree and the snapshot share all their nodes until the tree changes one of them.
+        Then the tree copies that node and its ancestors instead, so the snapshot can be read by other threads
+        without any locks while a single thread keeps changing the tree
+        :return: The QuadTreeSnapshot
+        """
+        self.generation += 1
+        return QuadTreeSnapshot(self)
+
+    def _rebuild(self, bbox=None):
+        """
+        Rebuild the whole tree from the top down with the elements it already has
+        The elements keep their handles
+        :param bbox: The bounding box of the new root, defaults to the bounding box of the current root
+        """
+        elements = []
+        self.root.get_elements(elements)
+        self.root = Node(bbox or self.root.bbox, 0, None, self.generation)
+        self.root.bulk_insert(elements, self)
+
+    def _expand_to(self, point):
+        """
+        Grow the root until its bbox contains a point, see auto_expand
+        :param point: The point
+        """
+        while True:
+            minx, miny, maxx, maxy = self.root.bbox
+            x, y = point
+            if minx <= x <= maxx and miny <= y <= maxy:
+                return
+
+            if minx == maxx or miny == maxy:
+                # A flat root can't be doubled, so the tree is rebuilt with a square around the root and the point
+                minx, miny = min(minx, x), min(miny, y)
+                size = max(maxx, x) - minx, max(maxy, y) - miny
+                self._rebuild((minx, miny, minx + max(size), miny + max(size)))
+                continue
+
+            self._grow(x < minx, y < miny)
+
+    def _grow(self, left, up):
+        """
+        Replace the root with a new root twice its size, which has the old root as one of its children
+        :param left: If True, the new root is grown to the left of the old root, otherwise to the right
+        :param up: If True, the new root is grown above the old root, otherwise below
+        """
+        old_root = self.root
+        minx, miny, maxx, maxy = old_root.bbox
+        width, height = maxx - minx, maxy - miny
+        if left:
+            minx -= width
+        else:
+            maxx += width
+        if up:
+            miny -= height
+        else:
+            maxy += height
+
+        midx = (minx + maxx) / 2
+        midy = (miny + maxy) / 2
+        root = Node((minx, miny, maxx, maxy), 0, None, self.generation)
+        root.count = old_root.count
+        root.children = [self.new_node((minx, miny, midx, midy), 1, root),
+                         self.new_node((minx, midy, midx, maxy), 1, root),
+                         self.new_node((midx, miny, maxx, midy), 1, root),
+                         self.new_node((midx, midy, maxx, maxy), 1, root)]
+
+        # The old root takes the place of the child it covers
+        index = 2 * left + up
+        self.recycle_nodes([root.children[index]])
+        root.children[index] = old_root
+        old_root.parent = root
+        self.root = root
+
+        self.max_depth += 1
+        self._shift_depths(old_root, 1)
+
+        # Points on the old root's left or top edge are now on the new root's middle line,
+        # so they belong in the child on the other side of it
+        edge_x = old_root.bbox[0] if left else None
+        edge_y = old_root.bbox[1] if up else None
+        on_edge = []
+        stack = [old_root]
+        while stack:
+            node = stack.pop()
+            if node.bbox[0] != edge_x and node.bbox[1] != edge_y:
+                continue
+            stack.extend(node.children)
+            on_edge.extend([element for element in node.elements
+                            if element.point[0] == edge_x or element.point[1] == edge_y])
+        for element in on_edge:
+            self._move_element(element, element.point)
+
+    def _shrink(self):
+        """
+        Make the root's child the new root for as long as all the elements are in that one child, see auto_expand
+        """
+        while self.root.children:
+            non_empty = [child for child in self.root.children if child.count]
+            if len(non_empty) != 1:
+                return
+
+            # The empty children can still have children of their own, left behind by an earlier _grow
+            child = non_empty[0]
+            empty_nodes = []
+            stack = [node for node in self.root.children if node is not child]
+            while stack:
+                node = stack.pop()
+                empty_nodes.append(node)
+                stack.extend(node.children)
+            self.recycle_nodes(empty_nodes)
+            child.parent = None
+            self.root = child
+
+            self.max_depth -= 1
+            self._shift_depths(child, -1)
+
+    def _shift_depths(self, node, amount):
+        """
+        Change the depth of a node and all of its descendants
+        :param node: The node
+        :param amount: How much to add to each depth
+        """
+        stack = [node]
+        while stack:
+            node = self.own(stack.pop())
+            node.depth += amount
+            stack.extend(node.children)
+
+    def _find_element(self, item, point):
+        """
+        Find the stored element of an item by searching the leaf its point is in
+        :param item: The item
+        :param point: The point the item is stored at
+        :return: The element
+        """
+        node = self.root
+        while node.children:
+            node = node.children[node.child_index(point)]
+
+        target = Element(item, point)
+        for e in node.elements:
+            if e == target:
+                return e
+        raise KeyError(item)
+
+    @instrumented
     def query(self, bbox):
         """
         Query the quadtree for all elements within a bounding box
@@ -132,13 +865,316 @@ class QuadTree:
         :param bbox: The bounding box to query (minx, miny, maxx, maxy)
         :return: A list of elements (maybe empty)
         """
+        root_bbox = self.root.bbox
         elements = []
+        for node, contained in self._query_nodes(bbox):
+            if contained:
+                # All the elements under this node are within the bbox, so none of them need to be compared
+                node.get_elements(elements)
+            else:
+                # Adding all the elements of the leaf within the query bounding box to the list
+                elements.extend(filter_leaf(node, bbox, root_bbox, self.vectorize))
+        return elements
+
+    @instrumented
+    def iter_query(self, bbox):
+        """
+        Query the quadtree for all elements within a bounding box, yielding them one leaf at a time
+        Nothing is searched until the elements are asked for, so stopping early skips the rest of the tree
+        The quadtree must not be changed while iterating
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: Generator of elements
+        """
+        root_bbox = self.root.bbox
+        for node, contained in self._query_nodes(bbox):
+            if contained:
+                stack = [node]
+                while stack:
+                    node = stack.pop()
+                    if node.children:
+                        stack.extend(node.children)
+                    else:
+                        yield from node.elements
+            else:
+                yield from filter_leaf(node, bbox, root_bbox, self.vectorize)
+
+    @instrumented
+    def any_in(self, bbox):
+        """
+        Check if there are any elements within a bounding box
+        Stops searching as soon as one is found
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: True if there is at least one element, False otherwise
+        """
+        root_bbox = self.root.bbox
+        for node, contained in self._query_nodes(bbox):
+            if node.count if contained else filter_leaf(node, bbox, root_bbox, self.vectorize):
+                return True
+        return False
+
+    @instrumented
+    def count(self, bbox):
+        """
+        Count the elements within a bounding box without building a list of them
+        Nodes fully within the bounding box are counted from their subtree count,
+        so only the leaves on the boundary of the bounding box are looked at
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: The number of elements
+        """
+        root_bbox = self.root.bbox
+        total = 0
+        for node, contained in self._query_nodes(bbox):
+            if contained:
+                total += node.count
+            else:
+                total += len(filter_leaf(node, bbox, root_bbox, self.vectorize))
+        return total
+
+    @instrumented
+    def aggregate(self, bbox, field):
+        """
+        Summarize a numeric attribute of the items within a bounding box
+        Nodes fully within the bounding box use their cached subtree summary, see Node.summary
+        If the attribute of a stored item changes, call clear_summaries so the cached summaries are recalculated
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :param field: The name of the item attribute to summarize
+        :return: A dictionary with the count, sum, min and max of the attribute, min and max are None if empty
+        """
+        root_bbox = self.root.bbox
+        summary = EMPTY_SUMMARY
+        for node, contained in self._query_nodes(bbox):
+            if contained:
+                summary = combine_summaries(summary, node.summary(field))
+            else:
+                elements = filter_leaf(node, bbox, root_bbox, self.vectorize)
+                summary = combine_summaries(summary, summarize(elements, field))
+
+        count, total, minimum, maximum = summary
+        return {"count": count, "sum": total, "min": minimum, "max": maximum}
+
+    def clear_summaries(self):
+        """
+        Throw away the cached summaries used by aggregate
+        Only needed when the attributes of items already in the tree change
+        """
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.summaries = None
+            stack.extend(node.children)
+
+    @instrumented
+    def query_radius(self, point, radius, sort=False, return_distances=False):
+        """
+        Query the quadtree for all elements within a distance of a point
+        Nodes further away than the radius are skipped, and nodes entirely inside the circle are taken
+        whole without comparing their elements
+        :param point: The center of the circle
+        :param radius: The radius of the circle, elements exactly this far away are included
+        :param sort: If True, the elements are sorted from closest to furthest
+        :param return_distances: If True, a list of (element, distance) tuples is returned instead
+        :return: A list of elements (maybe empty)
+        """
+        px, py = point
+        radius_sq = radius * radius
+        root_bbox = self.root.bbox
+        need_distances = sort or return_distances
+
+        elements = []
+        # (distance_sq, element) for each element when the distances are needed
+        found = []
+
+        stats = self._stats()
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if stats is not None:
+                stats.distance_computations += 1
+            if distance_sq_to_bbox(point, edge_bbox(node.bbox, root_bbox)) > radius_sq:
+                if stats is not None:
+                    stats.nodes_pruned += 1
+                continue
+            if stats is not None:
+                stats.nodes_visited += 1
+
+            if (not need_distances and max_distance_sq_to_bbox(point, node.bbox) <= radius_sq
+                    and not touches_edge(node.bbox, root_bbox)):
+                # The whole node is inside the circle
+                node.get_elements(elements)
+            elif node.children:
+                stack.extend(node.children)
+            else:
+                if stats is not None:
+                    stats.distance_computations += len(node.elements)
+                for e in node.elements:
+                    dx = px - e.point[0]
+                    dy = py - e.point[1]
+                    distance_sq = dx * dx + dy * dy
+                    if distance_sq <= radius_sq:
+                        if need_distances:
+                            found.append((distance_sq, e))
+                        else:
+                            elements.append(e)
+
+        if not need_distances:
+            return elements
+        if sort:
+            found.sort(key=lambda candidate: candidate[0])
+        return neighbors_result(found, return_distances)
+
+    @instrumented
+    def pairs_within(self, distance):
+        """
+        Find every pair of elements that are within a distance of each other
+        Walks the tree once, comparing each leaf with itself and with the other nodes close enough to it
+        Each unordered pair is only found once
+        :param distance: The maximum distance between the elements of a pair, pairs exactly this far apart are included
+        :return: Generator of (element, element) tuples
+        """
+        distance_sq = distance * distance
+        stats = self._stats()
+        for a, b in close_leaf_pairs(self.root, self.root, distance_sq, stats):
+            if a is b:
+                elements = a.elements
+                if stats is not None:
+                    stats.distance_computations += len(elements) * (len(elements) - 1) // 2
+                for i, e in enumerate(elements):
+                    x, y = e.point
+                    for other in elements[i + 1:]:
+                        dx = x - other.point[0]
+                        dy = y - other.point[1]
+                        if dx * dx + dy * dy <= distance_sq:
+                            yield e, other
+            else:
+                yield from close_element_pairs(a, b, distance_sq, stats)
+
+    @instrumented
+    def pairs_within_array(self, distance):
+        """
+        Find every pair of elements that are within a distance of each other, see pairs_within
+        The pairs are returned as the handles of the elements in a flat array of 64 bit integers,
+        [a0, b0, a1, b1, ...], which can be viewed as an (n, 2) NumPy array without copying with
+        numpy.frombuffer(pairs, dtype=numpy.int64).reshape(-1, 2)
+        :param distance: The maximum distance between the elements of a pair
+        :return: An array('q') of handles
+        """
+        pairs = array("q")
+        for a, b in self.pairs_within(distance):
+            pairs.append(a.handle)
+            pairs.append(b.handle)
+        return pairs
+
+    @instrumented
+    def join(self, other, max_distance):
+        """
+        Find every pair of an element in this quadtree and an element in another quadtree within a distance
+        Both trees are walked together, skipping the pairs of nodes that are too far apart
+        The trees can have different bounding boxes and settings
+        :param other: The other QuadTree
+        :param max_distance: The maximum distance between the elements of a pair, pairs exactly this far apart are
+                             included
+        :return: Generator of (element from this tree, element from the other tree) tuples
+        """
+        distance_sq = max_distance * max_distance
+        stats = self._stats()
+        for a, b in close_leaf_pairs(self.root, other.root, distance_sq, stats):
+            yield from close_element_pairs(a, b, distance_sq, stats)
+
+    @instrumented
+    def nearest_in(self, other, max_distance=float('inf'), return_distances=False):
+        """
+        Find the nearest element in another quadtree for every element in this quadtree
+        Each leaf of this tree searches the other tree once for all of its elements, visiting the other tree's nodes
+        in order of their distance to the leaf and skipping the nodes further than the leaf's furthest neighbor so far
+        :param other: The other QuadTree
+        :param max_distance: The maximum distance to search for a neighbor
+        :param return_distances: If True, (element, nearest, distance) tuples are returned instead
+        :return: A list of (element, nearest element in the other tree) tuples
+                 Elements without a neighbor within max_distance are left out
+        """
+        max_distance_sq = max_distance ** 2
+        results = []
+        root_bbox = self.root.bbox
+        other_root_bbox = other.root.bbox
+
+        stack = [self.root]
+        while stack:
+            leaf = stack.pop()
+            if leaf.children:
+                stack.extend(leaf.children)
+                continue
+            if not leaf.elements:
+                continue
+
+            # The closest distance squared and element found so far for each element of the leaf
+            best = [[max_distance_sq, None] for _ in leaf.elements]
+            bound_sq = max_distance_sq
+            leaf_bbox = edge_bbox(leaf.bbox, root_bbox)
+
+            counter = 0
+            # Elements outside of the other tree's bbox can be anywhere, so its root is always searched
+            nodes_to_check = [(0, counter, other.root)]
+            while nodes_to_check:
+                node_distance_sq, _, node = heappop(nodes_to_check)
+                if node_distance_sq >= bound_sq:
+                    break
+
+                if node.children:
+                    for child in node.children:
+                        child_distance_sq = distance_sq_between_bboxes(leaf_bbox,
+                                                                       edge_bbox(child.bbox, other_root_bbox))
+                        if child.count and child_distance_sq < bound_sq:
+                            counter += 1
+                            heappush(nodes_to_check, (child_distance_sq, counter, child))
+                else:
+                    for e, closest in zip(leaf.elements, best):
+                        x, y = e.point
+                        for candidate in node.elements:
+                            dx = x - candidate.point[0]
+                            dy = y - candidate.point[1]
+                            distance_sq = dx * dx + dy * dy
+                            if distance_sq < closest[0]:
+                                closest[0] = distance_sq
+                                closest[1] = candidate
+                    # No element of the leaf can get a closer neighbor from a node further than this
+                    bound_sq = max(closest[0] for closest in best)
+
+            for e, (distance_sq, nearest) in zip(leaf.elements, best):
+                if nearest is not None:
+                    results.append((e, nearest, sqrt(distance_sq)) if return_distances else (e, nearest))
+
+        return results
+
+    def _query_nodes(self, bbox):
+        """
+        Find the nodes that hold the elements within a bounding box
+        Does not use recursion
+        :param bbox: The bounding box to query (minx, miny, maxx, maxy)
+        :return: Generator of (node, contained) where contained is True if every element under the node is within
+                 the bbox, otherwise the node is a leaf whose elements still have to be filtered
+        """
+        minx, miny, maxx, maxy = bbox
+        root_bbox = self.root.bbox
+        stats = self._stats()
+
         stack = deque()
         stack.append(self.root)
 
         while stack:
             node = stack.pop()
+            if stats is not None:
+                stats.nodes_visited += 1
+
             if node.children:
+                if contains_node(bbox, node.bbox, root_bbox):
+                    yield node, True
+                    continue
+
+                if stats is not None:
+                    # Every child that isn't added to the stack is pruned
+                    stats.nodes_pruned += 4 + len(stack)
+
                 # Calculating which children intersect with the bbox
 
                 # The order of the children is:
@@ -146,15 +1182,16 @@ class QuadTree:
                 # -----
                 # 1 | 3
 
+                # Points on the midlines belong to the children on the left and top
                 midx = (node.bbox[0] + node.bbox[2]) / 2
                 midy = (node.bbox[1] + node.bbox[3]) / 2
 
-                miny_less_than_midy = bbox[1] < midy
-                maxy_greater_than_midy = bbox[3] > midy
+                miny_less_than_midy = miny <= midy
+                maxy_greater_than_midy = maxy > midy
 
                 # If the bbox's minx is less than the node's midx
                 # Checking children 0 and 1
-                if bbox[0] < midx:
+                if minx <= midx:
                     # If the bbox's miny is less than the node's midy
                     if miny_less_than_midy:
                         stack.append(node.children[0])
@@ -165,7 +1202,7 @@ class QuadTree:
 
                 # If the bbox's maxx is greater than the node's midx
                 # We need to check for children 2 and 3
-                if bbox[2] > midx:
+                if maxx > midx:
                     # If the bbox's miny is less than the node's midy
                     if miny_less_than_midy:
                         stack.append(node.children[2])
@@ -174,93 +1211,482 @@ class QuadTree:
                     if maxy_greater_than_midy:
                         stack.append(node.children[3])
 
-            else:
+                if stats is not None:
+                    stats.nodes_pruned -= len(stack)
+
+            elif node.elements:
                 # If the node has no children, it must be a leaf
-                # Adding all the elements within the query bounding box to the list
-                elements.extend(element for element in node.elements if
-                                bbox[0] <= element[0] < bbox[2] and bbox[1] <= element[1] < bbox[3])
+                if stats is not None:
+                    stats.elements_filtered += len(node.elements)
+                yield node, False
 
-        return elements
+    @instrumented
+    def query_many(self, bboxes, flat=False):
+        """
+        Query the quadtree with many bounding boxes at once
+        The tree is only traversed once, each node is tested against all the bounding boxes that reach it
+        :param bboxes: A sequence of bounding boxes to query (minx, miny, maxx, maxy)
+        :param flat: If True, return two lists (query_indices, elements) where query_indices[i] is the index of
+                     the bounding box that found elements[i]
+        :return: A list with a list of elements for each bounding box, in the same order as bboxes
+        """
+        bboxes = [tuple(bbox) for bbox in bboxes]
+        root_bbox = self.root.bbox
+
+        results = [[] for _ in bboxes]
+        stats = self._stats()
+        stack = [(self.root, range(len(bboxes)))]
+
+        while stack:
+            node, indices = stack.pop()
+            if stats is not None:
+                stats.nodes_visited += 1
+
+            if node.children:
+                midx = (node.bbox[0] + node.bbox[2]) / 2
+                midy = (node.bbox[1] + node.bbox[3]) / 2
+
+                # The indices of the bounding boxes that intersect with each child, same order as the children
+                quadrants = ([], [], [], [])
+                for i in indices:
+                    if contains_node(bboxes[i], node.bbox, root_bbox):
+                        node.get_elements(results[i])
+                        continue
+
+                    minx, miny, maxx, maxy = bboxes[i]
+                    if minx <= midx:
+                        if miny <= midy:
+                            quadrants[0].append(i)
+                        if maxy > midy:
+                            quadrants[1].append(i)
+                    if maxx > midx:
+                        if miny <= midy:
+                            quadrants[2].append(i)
+                        if maxy > midy:
+                            quadrants[3].append(i)
+
+                for child, child_indices in zip(node.children, quadrants):
+                    if child_indices:
+                        stack.append((child, child_indices))
+                    elif stats is not None:
+                        stats.nodes_pruned += 1
+
+            elif node.elements:
+                if stats is not None:
+                    stats.elements_filtered += len(node.elements) * len(indices)
+                for i in indices:
+                    results[i].extend(filter_leaf(node, bboxes[i], root_bbox, self.vectorize))
 
+        if flat:
+            query_indices = []
+            elements = []
+            for i, found in enumerate(results):
+                query_indices.extend([i] * len(found))
+                elements.extend(found)
+            return query_indices, elements
+        return results
+
+    @instrumented
     def nearest_neighbors(self, point: tuple, condition=None, max_distance=float('inf'),
-                          number_of_neighbors=1):
+                          number_of_neighbors=1, return_distances=False):
         """
         Finding the elements in the quadtree closest to the given point
 
-        Uses a depth first search with branch pruning to find the nearest neighbor quickly
+        Uses a best first search where the nodes are visited in order of the distance to their bounding box.
+        The closest elements found so far are kept in a max heap that holds at most number_of_neighbors elements,
+        so all the neighbors are found in a single traversal of the tree
 
         :param point: The point to find the nearest neighbor for
                       You could also use this to find the nearest neighbor to an item by passing in the item's point
         :param condition: A function that takes in an element and returns True if it should be considered
                             False otherwise
         :param max_distance: The maximum distance to search for a point
-        :param number_of_neighbors: The number of neighbors to find. Multiples the amount of time taken
-                                    by the number of neighbors desired
-        :return: List of the nearest neighbors found. len <= number_of_neighbors
+        :param number_of_neighbors: The number of neighbors to find
+        :param return_distances: If True, a list of (element, distance) tuples is returned instead
+        :return: List of the nearest neighbors found from closest to furthest. len <= number_of_neighbors
         """
+        if number_of_neighbors < 1:
+            return []
+        found = self._nearest(point, number_of_neighbors, max_distance ** 2, condition)
+        return neighbors_result(found, return_distances)
 
-        # The closest elements found in order from closest to furthest
-        # By the end of the search, this list will be number_of_neighbors long
-        nearest_neighbors_found = []
+    @instrumented
+    def nearest_neighbors_many(self, points, condition=None, max_distance=float('inf'),
+                               number_of_neighbors=1, return_distances=False):
+        """
+        Find the nearest neighbors for many points at once
+        The points are searched for leaf by leaf, and each search starts with an upper bound on the distance
+        taken from the previous point's neighbors, so most of the tree is pruned right away
+        :param points: A sequence of points to find the nearest neighbors for
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :param max_distance: The maximum distance to search for a point
+        :param number_of_neighbors: The number of neighbors to find for each point
+        :param return_distances: If True, lists of (element, distance) tuples are returned instead
+        :return: A list with the nearest neighbors of each point, in the same order as points
+        """
+        points = [tuple(point) for point in points]
+        if number_of_neighbors < 1:
+            return [[] for _ in points]
 
-        for _ in range(number_of_neighbors):
+        order = sorted(range(len(points)), key=lambda i: self._leaf_key(points[i]))
+        searches = self._nearest_in_order(((points[i], None) for i in order), number_of_neighbors,
+                                          max_distance ** 2, condition)
 
-            nodes_to_check = [self.root]
-            self.debug_elements_checked = []
+        results = [None] * len(points)
+        for i, found in zip(order, searches):
+            results[i] = neighbors_result(found, return_distances)
+        return results
 
-            closest_element = None
-            closest_distance_sq = max_distance ** 2
+    @instrumented
+    def knn_graph(self, number_of_neighbors=1, condition=None, max_distance=float('inf'), return_distances=False):
+        """
+        Find the nearest neighbors of every element in the quadtree, an element is never its own neighbor
+        The elements are searched for leaf by leaf, see nearest_neighbors_many
+        :param number_of_neighbors: The number of neighbors to find for each element
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :param max_distance: The maximum distance to search for a neighbor
+        :param return_distances: If True, lists of (element, distance) tuples are returned instead
+        :return: A dictionary from the handle of each element to its nearest neighbors from closest to furthest
+                 Keyed by handle so elements with the same item, or items that can't be hashed, each get an entry
+        """
+        # All the elements in depth first order, so the elements of each leaf are next to each other
+        elements = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(reversed(node.children))
+            else:
+                elements.extend(node.elements)
 
-            distances_calculated = 0
+        if number_of_neighbors < 1:
+            return {element.handle: [] for element in elements}
 
-            # Store the distance to the bounding box of each node to avoid recalculating it
-            # When a node is added to the stack, its distance is calculated and stored here
-            bbox_distance_memory = {}
+        searches = self._nearest_in_order(((element.point, element) for element in elements), number_of_neighbors,
+                                          max_distance ** 2, condition)
+        return {element.handle: neighbors_result(found, return_distances)
+                for element, found in zip(elements, searches)}
 
-            while len(nodes_to_check) > 0:
-                node = nodes_to_check.pop()
-                if node not in bbox_distance_memory:  # O(1) lookup to avoid recalculating the distance to the bbox
-                    bbox_distance_memory[node] = distance_sq_to_bbox(point, node.bbox)
+    def _nearest_in_order(self, searches, number_of_neighbors, max_distance_sq, condition):
+        """
+        Run many nearest neighbor searches, bounding each one with the results of the one before it
+        If the previous point's furthest neighbor is d away, then all of its neighbors are within
+        d + (distance between the points) of the next point, so the next search can ignore anything further
+        :param searches: An iterable of (point, element to exclude or None), close points should be next to each other
+        :param number_of_neighbors: The number of neighbors to find for each point
+        :param max_distance_sq: The maximum distance squared to search for a neighbor
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :return: Generator of the (distance_sq, element) lists from _nearest, in the same order as searches
+        """
+        previous_point = None
+        previous_distance = None
 
-                if bbox_distance_memory[node] > closest_distance_sq:
-                    # If the node is further than the closest point found so far, remove it from the stack
-                    continue
+        for point, exclude in searches:
+            bound_sq = max_distance_sq
+            if previous_distance is not None:
+                seeded_bound = previous_distance + sqrt((point[0] - previous_point[0]) ** 2 +
+                                                        (point[1] - previous_point[1]) ** 2)
+                # A little slack so neighbors exactly on the bound aren't lost to rounding
+                bound_sq = min(bound_sq, seeded_bound * seeded_bound * (1 + 1e-9))
 
-                if node.children:
-                    # Calculate the distance to the bounding box of each child
-                    for child in node.children:
-                        bbox_distance_memory[child] = distance_sq_to_bbox(point, child.bbox)
+            found = self._nearest(point, number_of_neighbors, bound_sq, condition, exclude)
+            if len(found) < number_of_neighbors and bound_sq < max_distance_sq:
+                # The bound was too tight, e.g. the previous point's neighbors didn't pass the condition
+                found = self._nearest(point, number_of_neighbors, max_distance_sq, condition, exclude)
 
-                    # Sort the children by distance to the point
-                    sorted_children = sorted(node.children, key=lambda c: bbox_distance_memory[c], reverse=True)
+            previous_point = point
+            previous_distance = sqrt(found[-1][0]) if len(found) == number_of_neighbors else None
+            yield found
 
-                    for child in sorted_children:
-                        # Only check the node if the box is close enough to have a point that is closer
-                        if bbox_distance_memory[child] < closest_distance_sq:
-                            nodes_to_check.append(child)
-                else:
-                    # This is a leaf node, check each element
-                    for e in node.elements:
-                        distance_sq = (point[0] - e[0]) ** 2 + (point[1] - e[1]) ** 2
-                        distances_calculated += 1
-                        self.debug_elements_checked.append(e)
-                        if (distance_sq < closest_distance_sq and (condition is None or condition(e.item))
-                                and e not in nearest_neighbors_found):
-                            closest_distance_sq = distance_sq
-                            closest_element = e
-
-                bbox_distance_memory.pop(node)
-            if closest_element:
-                nearest_neighbors_found.append(closest_element)
-        return nearest_neighbors_found
+    def _nearest(self, point, number_of_neighbors, bound_sq, condition, exclude=None):
+        """
+        The best first search used by nearest_neighbors
+        :param point: The point to find the nearest neighbors for
+        :param number_of_neighbors: The number of neighbors to find, at least 1
+        :param bound_sq: Only elements closer than this distance squared are considered
+        :param condition: A function that takes in an item and returns True if it should be considered
+        :param exclude: An element that is never a neighbor, used to skip the element at the point itself
+        :return: A list of (distance_sq, element) from closest to furthest
+        """
+        stats = self._stats()
+        px, py = point
+
+        # Max heap of the closest elements found so far, the distances are negated since heapq is a min heap
+        # The furthest of the candidates is at the top, so it can be replaced when a closer element is found
+        # The counter breaks ties between equal distances so the elements themselves are never compared
+        candidates = []
+        counter = 0
+
+        # Min heap of the nodes to check, ordered by the distance to their bounding box
+        # The nodes on the tree's edge also hold the points outside of its bbox, see edge_bbox
+        root_bbox = self.root.bbox
+        nodes_to_check = [(0, counter, self.root)]
+
+        while nodes_to_check:
+            node_distance_sq, _, node = heappop(nodes_to_check)
+            # Any element at or beyond bound_sq can't be one of the nearest neighbors
+            # It shrinks to the distance of the furthest candidate once number_of_neighbors candidates have been found
+            if node_distance_sq >= bound_sq:
+                # Every node left in the heap is at least this far away, so none of them can have a closer element
+                if stats is not None:
+                    stats.nodes_pruned += len(nodes_to_check) + 1
+                break
+
+            if stats is not None:
+                stats.nodes_visited += 1
+                stats.distance_computations += len(node.children) or len(node.elements)
+
+            if node.children:
+                for child in node.children:
+                    child_distance_sq = distance_sq_to_bbox(point, edge_bbox(child.bbox, root_bbox))
+                    # Only check the node if the box is close enough to have a point that is closer
+                    if child_distance_sq < bound_sq:
+                        counter += 1
+                        heappush(nodes_to_check, (child_distance_sq, counter, child))
+                    elif stats is not None:
+                        stats.nodes_pruned += 1
+            elif self.vectorize and len(node.elements) >= VECTORIZE_MIN_ELEMENTS:
+                # The distances to all the elements at once, then the close enough ones from closest to furthest
+                xs, ys = leaf_arrays(node)
+                distances_sq = (xs - px) ** 2 + (ys - py) ** 2
+                indices = numpy.flatnonzero(distances_sq < bound_sq)
+                indices = indices[numpy.argsort(distances_sq[indices], kind="stable")]
+                for i, distance_sq in zip(indices.tolist(), distances_sq[indices].tolist()):
+                    if distance_sq >= bound_sq:
+                        break
+                    e = node.elements[i]
+                    if e is not exclude and (condition is None or condition(e.item)):
+                        counter += 1
+                        if len(candidates) < number_of_neighbors:
+                            heappush(candidates, (-distance_sq, counter, e))
+                        else:
+                            heapreplace(candidates, (-distance_sq, counter, e))
+                        if len(candidates) == number_of_neighbors:
+                            bound_sq = -candidates[0][0]
+            else:
+                # This is a leaf node, check each element
+                for e in node.elements:
+                    dx = px - e.point[0]
+                    dy = py - e.point[1]
+                    distance_sq = dx * dx + dy * dy
+                    if (distance_sq < bound_sq and e is not exclude
+                            and (condition is None or condition(e.item))):
+                        counter += 1
+                        if len(candidates) < number_of_neighbors:
+                            heappush(candidates, (-distance_sq, counter, e))
+                        else:
+                            heapreplace(candidates, (-distance_sq, counter, e))
+                        if len(candidates) == number_of_neighbors:
+                            bound_sq = -candidates[0][0]
+
+        # Closest first, elements at the same distance are kept in the order they were found
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+        return [(-negative_distance_sq, e) for negative_distance_sq, _, e in candidates]
+
+    def _leaf_key(self, point):
+        """
+        Sort key that puts points in the same leaf next to each other and nearby leaves close together
+        The path of child indices from the root to the point's leaf, padded as if the leaf were at max_depth
+        :param point: The point
+        :return: An integer key
+        """
+        node = self.root
+        key = 0
+        while node.children:
+            index = node.child_index(point)
+            key = key * 4 + index
+            node = node.children[index]
+        return key << 2 * (self.max_depth - node.depth)
+
+    def freeze(self):
+        """
+        Make a read-only copy of the quadtree stored in one flat binary buffer, see FrozenQuadTree
+        :return: The FrozenQuadTree
+        """
+        from .frozen_quadtree import FrozenQuadTree, freeze
+        return FrozenQuadTree(freeze(self))
+
+    def save(self, path):
+        """
+        Save the quadtree to a file in the flat binary layout of FrozenQuadTree
+        The items are pickled, so they have to be picklable
+        :param path: The path of the file
+        """
+        from .frozen_quadtree import freeze
+        with open(path, "wb") as file:
+            file.write(freeze(self))
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Load a quadtree saved by save as a read-only FrozenQuadTree
+        It can be queried right away since no nodes are created
+        :param path: The path of the file
+        :param mmap: If True, the file is memory-mapped instead of read, so it is only read as it is queried
+        :return: The FrozenQuadTree, call close on it to close the file
+        """
+        from .frozen_quadtree import load
+        return load(path, mmap)
+
+    def stats(self):
+        """
+        Describe the shape of the tree, to help pick max_elements and max_depth
+        Walks the tree once without making a list of the nodes
+        :return: A dictionary with:
+                 nodes, leaves, elements: the number of each
+                 depth_histogram: a list with the number of nodes at each depth
+                 leaf_occupancy: a list with the number of leaves holding 0, 1, 2, ... elements
+                 empty_leaves: the number of leaves without any elements
+                 nodes_at_max_depth: the number of nodes at max_depth, they can't split no matter how full they get
+                 average_leaf_occupancy: the average number of elements in a leaf
+        """
+        depth_histogram = []
+        leaf_occupancy = []
+        leaves = 0
+        nodes_at_max_depth = 0
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            depth = node.depth - self.root.depth
+            if depth >= len(depth_histogram):
+                depth_histogram.extend([0] * (depth + 1 - len(depth_histogram)))
+            depth_histogram[depth] += 1
+            if node.depth >= self.max_depth:
+                nodes_at_max_depth += 1
+
+            if node.children:
+                stack.extend(node.children)
+            else:
+                leaves += 1
+                occupancy = len(node.elements)
+                if occupancy >= len(leaf_occupancy):
+                    leaf_occupancy.extend([0] * (occupancy + 1 - len(leaf_occupancy)))
+                leaf_occupancy[occupancy] += 1
+
+        return {
+            "nodes": sum(depth_histogram),
+            "leaves": leaves,
+            "elements": self.root.count,
+            "depth_histogram": depth_histogram,
+            "leaf_occupancy": leaf_occupancy,
+            "empty_leaves": leaf_occupancy[0] if leaf_occupancy else 0,
+            "nodes_at_max_depth": nodes_at_max_depth,
+            "average_leaf_occupancy": self.root.count / leaves,
+        }
+
+    def autotune(self, sample_queries, candidates=None, sample_size=None, repeat=3, rebuild=False, seed=0):
+        """
+        Find the max_elements and max_depth that answer some sample queries the fastest on this tree's points
+        A tree is built from the points for each candidate, then the queries are timed on it
+        :param sample_queries: A list of queries like the real ones, bounding boxes (minx, miny, maxx, maxy)
+                               are run with query and points (x, y) with nearest_neighbors
+        :param candidates: A list of (max_elements, max_depth) to try, defaults to a grid around common values
+        :param sample_size: Only build the trees from this many of the points, picked at random
+                            Defaults to all of them. A sample has fewer points in every area than the whole tree,
+                            so it may favor smaller max_elements or max_depth than the whole tree needs
+        :param repeat: The number of times the queries are run for each candidate, the fastest is kept
+        :param rebuild: If True, the tree is rebuilt with the fastest max_elements and max_depth
+        :param seed: The seed for picking the sample
+        :return: A dictionary with the fastest max_elements, max_depth, and its seconds, and results,
+                 a list of (max_elements, max_depth, seconds) for every candidate from fastest to slowest
+        """
+        if candidates is None:
+            candidates = [(max_elements, max_depth) for max_elements in (4, 8, 16, 32, 64)
+                          for max_depth in (8, 10, 12, 16)]
+
+        points = [element.point for element in self.get_all_elements()]
+        if sample_size is not None and sample_size < len(points):
+            points = random.Random(seed).sample(points, sample_size)
+        bboxes = [query for query in sample_queries if len(query) == 4]
+        query_points = [query for query in sample_queries if len(query) == 2]
+
+        results = []
+        for max_elements, max_depth in candidates:
+            qtree = QuadTree.from_points(points, bbox=self.root.bbox, max_elements=max_elements,
+                                         max_depth=max_depth, track_items=False)
+            best = float("inf")
+            for _ in range(repeat):
+                start = perf_counter()
+                for bbox in bboxes:
+                    qtree.query(bbox)
+                for point in query_points:
+                    qtree.nearest_neighbors(point)
+                best = min(best, perf_counter() - start)
+            results.append((max_elements, max_depth, best))
+
+        results.sort(key=lambda result: result[2])
+        max_elements, max_depth, seconds = results[0]
+
+        if rebuild:
+            # A merge_threshold that was left at its default keeps following max_elements
+            if self.merge_threshold == self.max_elements or self.merge_threshold > max_elements:
+                self.merge_threshold = max_elements
+            self.max_elements = max_elements
+            self.max_depth = max_depth
+            self._rebuild()
+
+        return {"max_elements": max_elements, "max_depth": max_depth, "seconds": seconds, "results": results}
 
     def get_all_bbox(self):
         all_bbox = []
         self.root.get_bbox(all_bbox)
         return all_bbox
 
+    def get_all_elements(self):
+        return list(self.handle_to_element_map.values())
+
+
+class QuadTreeSnapshot(QuadTree):
+    """
+    A read-only view of a QuadTree at the time it was taken, see QuadTree.snapshot
+    All the queries work like they do on the QuadTree, the methods that would change the tree raise a TypeError
+    """
+
+    def __init__(self, qtree):
+        """
+        :param qtree: The QuadTree the snapshot is of
+        """
+        self.root = qtree.root
+        self.max_elements = qtree.max_elements
+        self.max_depth = qtree.max_depth
+        self.merge_threshold = qtree.merge_threshold
+        self.track_items = qtree.track_items
+        self.auto_expand = False
+        self.vectorize = qtree.vectorize
+        self.split_count = qtree.split_count
+        self.merge_count = qtree.merge_count
+
+        # Copying the maps would take O(n) time, so they aren't kept
+        self.item_to_point_map = None
+        self.handle_to_element_map = None
+        self.next_handle = qtree.next_handle
+
+        # The snapshot never makes or reuses nodes, so the generation is never compared
+        self.generation = qtree.generation
+        self.node_pool = []
+        self.node_pool_size = 0
+
+        self.instrumentation = qtree.instrumentation
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("A QuadTreeSnapshot can't be changed")
+
+    add = add_many = delete = move = update_many = _rebuild = _read_only
+
+    def autotune(self, sample_queries, candidates=None, sample_size=None, repeat=3, rebuild=False, seed=0):
+        """
+        Same as QuadTree.autotune, but the snapshot can't be rebuilt
+        Rebuilding would change the nodes of the elements it shares with the tree
+        """
+        if rebuild:
+            self._read_only()
+        return super().autotune(sample_queries, candidates, sample_size, repeat, rebuild, seed)
+
+    def snapshot(self):
+        return self
+
     def get_all_elements(self):
         all_elements = []
-        for item in self.item_to_point_map.keys():
-            all_elements.append(Element(item, self.item_to_point_map[item]))
+        self.root.get_elements(all_elements)
         return all_elements
@@ -8,5 +8,5 @@ setup(
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     url="",
-    packages=find_packages(),  # Automatically find and include all packages
+    packages=find_packages(exclude=["benchmarks"]),  # Automatically find and include all packages
 )
\ No newline at end of file
@@ -1,6 +1,22 @@
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from pyquadtree import QuadTree
+from pyquadtree import QuadTree, LooseQuadTree, LinearQuadTree, FrozenQuadTree, ParallelQueryExecutor, Instrumentation
 import random
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from benchmarks.__main__ import main as benchmarks_main
+from benchmarks.suite import compare, run_workload
+from benchmarks.workloads import WORKLOADS
 
 
 class AddThenQuery(unittest.TestCase):
@@ -134,5 +150,1047 @@ class AddManyThenQueryForMany(unittest.TestCase):
         self.group_query()
 
 
+class NearestNeighbors(unittest.TestCase):
+    def build(self, seed):
+        random.seed(seed)
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        items = []
+        for i in range(2000):
+            x = random.randint(-500, 500)
+            y = random.randint(-500, 500)
+            items.append((i, x, y))
+            qtree.add(i, (x, y))
+        return qtree, items
+
+    def test_matches_brute_force(self):
+        qtree, items = self.build(1)
+        for _ in range(50):
+            px = random.randint(-500, 500)
+            py = random.randint(-500, 500)
+            found = qtree.nearest_neighbors((px, py), number_of_neighbors=20, return_distances=True)
+            distances = sorted(((px - x) ** 2 + (py - y) ** 2) ** 0.5 for _, x, y in items)
+            self.assertEqual([distance for _, distance in found], distances[:20])
+
+    def test_condition_and_max_distance(self):
+        qtree, items = self.build(2)
+        found = qtree.nearest_neighbors((0, 0), condition=lambda item: item % 2 == 0, max_distance=100,
+                                        number_of_neighbors=2000)
+        expected = sorted((x ** 2 + y ** 2, i) for i, x, y in items if i % 2 == 0 and x ** 2 + y ** 2 < 100 ** 2)
+        self.assertEqual(sorted(e.item for e in found), sorted(i for _, i in expected))
+        self.assertEqual([e[0] ** 2 + e[1] ** 2 for e in found], [distance_sq for distance_sq, _ in expected])
+
+    def test_no_neighbors(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        self.assertEqual(qtree.nearest_neighbors((0, 0), number_of_neighbors=5), [])
+
+    def test_outside_of_bbox(self):
+        qtree = QuadTree((0, 0, 100, 100), 2)
+        for i, point in enumerate([(10, 10), (100, 50), (200, 60), (50, 50), (20, 20)]):
+            qtree.add(i, point)
+        self.assertEqual(qtree.nearest_neighbors((200, 50), return_distances=True)[0][1], 10)
+        self.assertEqual([e.item for e in qtree.nearest_neighbors_many([(200, 50), (0, 0)])[0]], [2])
+        self.assertEqual(qtree.knn_graph()[1][0].item, 3)
+
+
+@unittest.skipIf(numpy is None, "NumPy isn't installed")
+class NumpyBackend(unittest.TestCase):
+    def test_matches_python(self):
+        random.seed(18)
+        points = [(random.gauss(50, 5), random.gauss(50, 5)) for _ in range(3000)] + [(150, 50), (-20, -20)]
+        trees = [QuadTree.from_points(points, bbox=(0, 0, 100, 100), max_elements=8, max_depth=4, backend=backend)
+                 for backend in ("python", "numpy")]
+
+        for step in range(4):
+            for _ in range(30):
+                x, y = random.uniform(-30, 110), random.uniform(-30, 110)
+                bbox = (x, y, x + random.uniform(0, 60), y + random.uniform(0, 60))
+                python, vectorized = [sorted(e.handle for e in qtree.query(bbox)) for qtree in trees]
+                self.assertEqual(vectorized, python)
+                self.assertEqual(trees[1].count(bbox), len(python))
+
+                point = (random.uniform(-30, 160), random.uniform(-30, 110))
+                python, vectorized = [[d for _, d in qtree.nearest_neighbors(point, number_of_neighbors=7,
+                                                                            return_distances=True)]
+                                      for qtree in trees]
+                self.assertEqual(vectorized, python)
+
+            # The arrays have to follow the elements as they move, in place and between leaves
+            for handle in random.sample(range(3000), 200):
+                x, y = trees[0].handle_to_element_map[handle].point
+                point = (x + random.uniform(-0.01, 0.01), y) if step % 2 else (random.uniform(0, 100), y)
+                for qtree in trees:
+                    qtree.move(handle=handle, new_point=point)
+
+    def test_bad_backend(self):
+        self.assertRaises(ValueError, QuadTree, (0, 0, 10, 10), backend="fortran")
+
+
+class BulkLoad(unittest.TestCase):
+    def random_points(self, seed, n):
+        random.seed(seed)
+        return [(random.randint(-500, 500), random.randint(-500, 500)) for _ in range(n)]
+
+    def test_from_points_matches_add(self):
+        points = self.random_points(1, 5000)
+        bulk = QuadTree.from_points(points, bbox=(-500, -500, 500, 500), max_elements=3, max_depth=10)
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i, point in enumerate(points):
+            qtree.add(i, point)
+
+        for query in [(-30, -30, 30, 30), (-500, -500, 0, 0), (100, -200, 450, 20)]:
+            self.assertEqual(sorted(e.item for e in bulk.query(query)), sorted(e.item for e in qtree.query(query)))
+        self.assertEqual(len(bulk.get_all_elements()), 5000)
+        self.assertLessEqual(len(bulk.get_all_bbox()), len(qtree.get_all_bbox()))
+
+    def test_add_many_to_existing_tree(self):
+        points = self.random_points(2, 3000)
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i, point in enumerate(points[:1000]):
+            qtree.add(i, point)
+        qtree.add_many(range(1000, 3000), points[1000:])
+
+        found = sorted(e.item for e in qtree.query((-50, -50, 50, 50)))
+        expected = [i for i, (x, y) in enumerate(points) if -50 <= x < 50 and -50 <= y < 50]
+        self.assertEqual(found, expected)
+
+    def test_from_points_default_bbox(self):
+        qtree = QuadTree.from_points([(1, 2), (3, 4)], items=["a", "b"])
+        self.assertEqual(qtree.root.bbox, (1, 2, 3, 4))
+        self.assertEqual(qtree.nearest_neighbors((3, 3))[0].item, "b")
+        self.assertRaises(ValueError, QuadTree.from_points, [])
+
+
+class CompactStorage(unittest.TestCase):
+    def test_no_instance_dicts(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i in range(100):
+            qtree.add(i, (random.randint(-500, 500), random.randint(-500, 500)))
+        self.assertFalse(hasattr(qtree.root, "__dict__"))
+        self.assertFalse(hasattr(qtree.root.children[0], "__dict__"))
+        self.assertFalse(hasattr(qtree.query((-500, -500, 500, 500))[0], "__dict__"))
+
+
+class QueryEdges(unittest.TestCase):
+    def test_point_on_midline(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i in range(10):
+            qtree.add(i, (-400 + i, -400 + i))
+        qtree.add("center", (0, 0))
+        self.assertEqual([e.item for e in qtree.query((0, 0, 10, 10))], ["center"])
+
+    def test_contained_edge_node_with_out_of_bounds_point(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i in range(20):
+            qtree.add(i, (i * 20 + 10, i * 20 + 10))
+        qtree.add("outside", (600, 600))
+        found = [e.item for e in qtree.query((-1, -1, 501, 501))]
+        self.assertEqual(sorted(found), list(range(20)))
+
+    def test_large_queries_match_brute_force(self):
+        random.seed(4)
+        points = [(random.uniform(-500, 500), random.uniform(-500, 500)) for _ in range(5000)]
+        qtree = QuadTree.from_points(points, bbox=(-500, -500, 500, 500), max_elements=5)
+        for _ in range(20):
+            minx, miny = random.uniform(-600, 400), random.uniform(-600, 400)
+            query = (minx, miny, minx + random.uniform(0, 700), miny + random.uniform(0, 700))
+            expected = [i for i, (x, y) in enumerate(points) if query[0] <= x < query[2] and query[1] <= y < query[3]]
+            self.assertEqual(sorted(e.item for e in qtree.query(query)), expected)
+
+
+class QueryMany(unittest.TestCase):
+    def test_matches_query(self):
+        random.seed(5)
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        for i in range(3000):
+            qtree.add(i, (random.randint(-500, 500), random.randint(-500, 500)))
+
+        bboxes = []
+        for _ in range(200):
+            minx, miny = random.randint(-520, 480), random.randint(-520, 480)
+            bboxes.append((minx, miny, minx + random.randint(0, 200), miny + random.randint(0, 200)))
+
+        results = qtree.query_many(bboxes)
+        self.assertEqual(len(results), len(bboxes))
+        for bbox, found in zip(bboxes, results):
+            self.assertEqual(sorted(e.item for e in found), sorted(e.item for e in qtree.query(bbox)))
+
+        query_indices, elements = qtree.query_many(bboxes, flat=True)
+        self.assertEqual(len(query_indices), sum(len(found) for found in results))
+        for i, element in zip(query_indices, elements):
+            self.assertIn(element, results[i])
+
+    def test_no_bboxes(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        self.assertEqual(qtree.query_many([]), [])
+
+
+class NearestNeighborsMany(unittest.TestCase):
+    def setUp(self):
+        random.seed(6)
+        self.points = [(random.randint(-500, 500), random.randint(-500, 500)) for _ in range(1500)]
+        self.qtree = QuadTree.from_points(self.points, bbox=(-500, -500, 500, 500), max_elements=4)
+
+    def brute_force(self, point, k, exclude=None):
+        distances = sorted(((point[0] - x) ** 2 + (point[1] - y) ** 2) ** 0.5
+                           for i, (x, y) in enumerate(self.points) if i != exclude)
+        return distances[:k]
+
+    def test_matches_brute_force(self):
+        queries = [(random.randint(-600, 600), random.randint(-600, 600)) for _ in range(100)]
+        results = self.qtree.nearest_neighbors_many(queries, number_of_neighbors=8, return_distances=True)
+        for query, found in zip(queries, results):
+            self.assertEqual([distance for _, distance in found], self.brute_force(query, 8))
+
+    def test_condition(self):
+        queries = [(random.randint(-500, 500), random.randint(-500, 500)) for _ in range(50)]
+        results = self.qtree.nearest_neighbors_many(queries, condition=lambda item: item % 7 == 0,
+                                                    number_of_neighbors=3)
+        for query, found in zip(queries, results):
+            self.assertEqual(found, self.qtree.nearest_neighbors(query, condition=lambda item: item % 7 == 0,
+                                                                 number_of_neighbors=3))
+
+    def test_knn_graph_excludes_self(self):
+        graph = self.qtree.knn_graph(number_of_neighbors=5, return_distances=True)
+        self.assertEqual(len(graph), len(self.points))
+        # from_points makes the handle of each element the index of its point
+        for handle, found in graph.items():
+            self.assertNotIn(handle, [e.handle for e, _ in found])
+            self.assertEqual([distance for _, distance in found], self.brute_force(self.points[handle], 5, handle))
+
+    def test_knn_graph_same_items(self):
+        qtree = QuadTree((0, 0, 10, 10), track_items=False)
+        handles = [qtree.add(item, point) for item, point in [([1], (1, 1)), ([1], (2, 2)), ([2], (5, 5))]]
+        graph = qtree.knn_graph()
+        self.assertEqual(sorted(graph), handles)
+        self.assertEqual(graph[handles[0]][0].handle, handles[1])
+
+
+class DeleteByHandle(unittest.TestCase):
+    def check_indices(self, qtree):
+        for element in qtree.get_all_elements():
+            self.assertIs(element.node.elements[element.index], element)
+
+    def test_delete_all_merges_back_to_root(self):
+        random.seed(7)
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        handles = [qtree.add(i, (random.randint(-500, 500), random.randint(-500, 500))) for i in range(1000)]
+        self.assertEqual(handles, list(range(1000)))
+
+        random.shuffle(handles)
+        for count, handle in enumerate(handles):
+            qtree.delete(handle=handle)
+            if count % 100 == 0:
+                self.check_indices(qtree)
+                self.assertEqual(len(qtree.query((-500, -500, 501, 501))), 999 - count)
+
+        self.assertEqual(qtree.root.children, [])
+        self.assertEqual(qtree.root.elements, [])
+        self.assertEqual(qtree.item_to_point_map, {})
+
+    def test_mixed_delete(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10)
+        handles = qtree.add_many(range(50), [(i * 10, -i * 10) for i in range(50)])
+        qtree.delete(3)
+        qtree.delete(handle=handles[4])
+        self.check_indices(qtree)
+        found = sorted(e.item for e in qtree.query((-500, -500, 501, 501)))
+        self.assertEqual(found, [i for i in range(50) if i not in (3, 4)])
+        self.assertRaises(KeyError, qtree.delete, handle=handles[4])
+
+    def test_duplicate_items(self):
+        for tree_class in (QuadTree, LinearQuadTree):
+            qtree = tree_class((-500, -500, 500, 500), 3, 10)
+            first = qtree.add("a", (10, 10))
+            second = qtree.add("a", (-200, 300))
+            qtree.delete(handle=first)
+            qtree.delete(handle=second)
+            self.assertEqual(qtree.get_all_elements(), [])
+            self.assertEqual(qtree.item_to_point_map, {})
+
+            # Deleting by item removes the copy at the point it was added at last, an unknown item changes nothing
+            qtree.add("b", (10, 10))
+            last = qtree.add("b", (-200, 300))
+            qtree.delete("b")
+            self.assertRaises(KeyError, qtree.delete, "b")
+            self.assertEqual([e.point for e in qtree.get_all_elements()], [(10, 10)])
+            self.assertNotIn(last, qtree.handle_to_element_map)
+
+    def test_unhashable_items(self):
+        qtree = QuadTree((-500, -500, 500, 500), 3, 10, track_items=False)
+        handles = [qtree.add([i], (i, i)) for i in range(20)]
+        qtree.delete(handle=handles[0])
+        self.assertEqual(len(qtree.get_all_elements()), 19)
+        self.assertEqual(qtree.nearest_neighbors((0, 0))[0].item, [1])
+        self.assertRaises(ValueError, qtree.delete, [1])
+
+
+class Move(unittest.TestCase):
+    def setUp(self):
+        random.seed(8)
+        self.points = {i: (random.uniform(-500, 500), random.uniform(-500, 500)) for i in range(2000)}
+        self.qtree = QuadTree((-500, -500, 500, 500), 4, 10)
+        self.handles = self.qtree.add_many(list(self.points), list(self.points.values()))
+
+    def check(self):
+        for element in self.qtree.get_all_elements():
+            self.assertIs(element.node.elements[element.index], element)
+            self.assertEqual(element.point, self.points[element.item])
+        for _ in range(20):
+            minx, miny = random.uniform(-500, 400), random.uniform(-500, 400)
+            query = (minx, miny, minx + 100, miny + 100)
+            expected = [i for i, (x, y) in self.points.items() if minx <= x < minx + 100 and miny <= y < miny + 100]
+            self.assertEqual(sorted(e.item for e in self.qtree.query(query)), expected)
+
+    def jitter(self, item, distance):
+        x, y = self.points[item]
+        return (min(max(x + random.uniform(-distance, distance), -500), 500),
+                min(max(y + random.uniform(-distance, distance), -500), 500))
+
+    def test_move(self):
+        for _ in range(3):
+            for item in range(0, 2000, 2):
+                self.points[item] = self.jitter(item, 5)
+                self.qtree.move(item, self.points[item])
+            for item in range(1, 2000, 2):
+                self.points[item] = self.jitter(item, 300)
+                self.qtree.move(new_point=self.points[item], handle=self.handles[item])
+            self.check()
+
+    def test_move_in_place(self):
+        element = self.qtree.get_all_elements()[0]
+        leaf = element.node
+        x, y = element.point
+        minx, miny, maxx, maxy = leaf.bbox
+        new_point = ((minx + maxx) / 2, (miny + maxy) / 2)
+        self.qtree.move(element.item, new_point)
+        self.assertIs(element.node, leaf)
+        self.assertEqual(self.qtree.item_to_point_map[element.item], new_point)
+
+    def test_update_many(self):
+        for rebuild_threshold in (0.5, 0):
+            items = random.sample(range(2000), 500)
+            for item in items:
+                self.points[item] = self.jitter(item, 50)
+            self.qtree.update_many(items, [self.points[item] for item in items], rebuild_threshold=rebuild_threshold)
+            self.check()
+
+
+class SplitMergeHysteresis(unittest.TestCase):
+    def oscillate(self, qtree):
+        for i, point in enumerate([(-200, -200), (200, -200), (-200, 200), (200, 200), (100, 100)]):
+            qtree.add(i, point)
+        for _ in range(100):
+            qtree.delete(0)
+            qtree.add(0, (-200, -200))
+
+    def test_thrash_without_hysteresis(self):
+        qtree = QuadTree((-500, -500, 500, 500), 4, 10)
+        self.oscillate(qtree)
+        self.assertEqual(qtree.split_count, 101)
+        self.assertEqual(qtree.merge_count, 100)
+
+    def test_merge_threshold(self):
+        qtree = QuadTree((-500, -500, 500, 500), 4, 10, merge_threshold=2)
+        self.oscillate(qtree)
+        self.assertEqual(qtree.split_count, 1)
+        self.assertEqual(qtree.merge_count, 0)
+        for i in range(1, 4):
+            qtree.delete(i)
+        self.assertEqual(qtree.merge_count, 1)
+        self.assertEqual(sorted(e.item for e in qtree.root.elements), [0, 4])
+        self.assertRaises(ValueError, QuadTree, (-500, -500, 500, 500), 4, 10, merge_threshold=5)
+
+    def test_node_pool(self):
+        qtree = QuadTree((-500, -500, 500, 500), 4, 10, node_pool_size=16)
+        self.oscillate(qtree)
+        first_children = qtree.root.children
+        qtree.delete(0)
+        self.assertEqual(qtree.root.children, [])
+        self.assertLessEqual(len(qtree.node_pool), 16)
+        qtree.add(0, (-200, -200))
+        self.assertTrue(all(child in first_children for child in qtree.root.children))
+        self.assertEqual(sorted(e.item for e in qtree.query((-500, -500, 500, 500))), [0, 1, 2, 3, 4])
+
+
+class AutoExpand(unittest.TestCase):
+    def test_grows_to_fit(self):
+        qtree = QuadTree((0, 0, 10, 10), 2, 4, auto_expand=True)
+        points = {i: (i, i) for i in range(11)}
+        points.update({"far": (-75, 300), "edge": (0, 5)})
+        for item, point in points.items():
+            qtree.add(item, point)
+
+        minx, miny, maxx, maxy = qtree.root.bbox
+        self.assertTrue(all(minx <= x <= maxx and miny <= y <= maxy for x, y in points.values()))
+        self.assertEqual(maxx - minx, 320)
+        self.assertEqual(qtree.max_depth, 9)
+        self.assertEqual(sorted(e.item for e in qtree.query((-1, 4, 1, 6))), ["edge"])
+        self.assertEqual(qtree.nearest_neighbors((-70, 290))[0].item, "far")
+
+    def test_shrinks_back(self):
+        qtree = QuadTree((0, 0, 10, 10), 2, 4, auto_expand=True)
+        for i in range(5):
+            qtree.add(i, (2 * i + 0.5, 2 * i + 0.5))
+        qtree.add("far", (1000, 1000))
+        qtree.move(2, (-1000, 5))
+        qtree.delete("far")
+        qtree.move(2, (4.5, 4.5))
+        self.assertEqual(qtree.root.bbox, (0, 0, 10, 10))
+        self.assertEqual(qtree.max_depth, 4)
+        self.assertEqual(sorted(e.item for e in qtree.query((0, 0, 10, 10))), [0, 1, 2, 3, 4])
+
+    def test_with_node_pool(self):
+        qtree = QuadTree((0, 0, 10, 10), 2, 4, node_pool_size=8, auto_expand=True)
+        qtree.add("a", (104, -91))
+        qtree.add("b", (107, 9))
+        qtree.delete("b")
+        qtree.add("c", (102, 8))
+        self.assertEqual(qtree.query((-50, -50, 50, 50)), [])
+
+        random.seed(17)
+        points = {}
+        for step in range(2000):
+            item = random.randrange(40)
+            point = (random.uniform(-300, 300), random.uniform(-300, 300))
+            if item not in points:
+                qtree.add(item, point)
+                points[item] = point
+            elif step % 3:
+                qtree.move(item, point)
+                points[item] = point
+            else:
+                qtree.delete(item)
+                del points[item]
+        query = (-100, -100, 100, 100)
+        self.assertEqual(sorted(e.item for e in qtree.query(query)),
+                         sorted(i for i, (x, y) in points.items() if -100 <= x < 100 and -100 <= y < 100))
+
+    def test_flat_root(self):
+        qtree = QuadTree.from_points([(3, 3), (3, 3)], auto_expand=True)
+        qtree.add(2, (3, 8))
+        self.assertEqual(qtree.root.bbox, (3, 3, 8, 8))
+        self.assertEqual(sorted(e.item for e in qtree.query((0, 0, 10, 10))), [0, 1, 2])
+
+
+class Snapshots(unittest.TestCase):
+    def setUp(self):
+        random.seed(11)
+        self.qtree = QuadTree((0, 0, 100, 100), 4, 8, node_pool_size=32)
+        for i in range(300):
+            self.qtree.add(i, (random.uniform(0, 100), random.uniform(0, 100)))
+
+    @staticmethod
+    def contents(qtree):
+        return sorted((e.item, e.point) for e in qtree.query((0, 0, 101, 101)))
+
+    def test_unchanged_by_writes(self):
+        snapshot = self.qtree.snapshot()
+        before = self.contents(snapshot)
+        nearest = [e.item for e in snapshot.nearest_neighbors((50, 50), number_of_neighbors=5)]
+
+        for i in range(0, 300, 3):
+            self.qtree.delete(i)
+        for i in range(1, 300, 3):
+            self.qtree.move(i, (random.uniform(0, 100), random.uniform(0, 100)))
+        for i in range(300, 400):
+            self.qtree.add(i, (random.uniform(0, 100), random.uniform(0, 100)))
+
+        self.assertEqual(self.contents(snapshot), before)
+        self.assertEqual(snapshot.count((0, 0, 101, 101)), 300)
+        self.assertEqual([e.item for e in snapshot.nearest_neighbors((50, 50), number_of_neighbors=5)], nearest)
+        self.assertEqual(len(self.contents(self.qtree)), 300)
+        self.assertEqual(len(self.qtree.snapshot().get_all_elements()), 300)
+
+    def test_only_shared_elements_copied(self):
+        snapshot = self.qtree.snapshot()
+        handle = self.qtree.add("new", (50, 50))
+        new_element = self.qtree.handle_to_element_map[handle]
+        self.qtree.move("new", (50.001, 50.001))
+        self.assertIs(self.qtree.handle_to_element_map[handle], new_element)
+
+        # An element from before the snapshot is copied once, then moved in place
+        old_element = self.qtree.handle_to_element_map[0]
+        self.qtree.move(0, (1, 1))
+        copy = self.qtree.handle_to_element_map[0]
+        self.assertIsNot(copy, old_element)
+        self.qtree.move(0, (99, 99))
+        self.assertIs(self.qtree.handle_to_element_map[0], copy)
+        self.assertEqual(copy.point, (99, 99))
+        self.assertNotIn((0, (99, 99)), self.contents(snapshot))
+
+    def test_read_only(self):
+        snapshot = self.qtree.snapshot()
+        self.assertRaises(TypeError, snapshot.add, "new", (1, 1))
+        self.assertRaises(TypeError, snapshot.delete, 0)
+        self.assertRaises(TypeError, snapshot.move, 0, (1, 1))
+
+    def test_readers_while_writing(self):
+        snapshot = self.qtree.snapshot()
+        expected = self.contents(snapshot)
+        results = []
+
+        def read():
+            for _ in range(20):
+                results.append(self.contents(snapshot) == expected)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for i in range(300):
+            self.qtree.move(i, (random.uniform(0, 100), random.uniform(0, 100)))
+        for reader in readers:
+            reader.join()
+        self.assertTrue(all(results))
+        self.assertEqual(len(results), 80)
+
+
+class Instrumented(unittest.TestCase):
+    def test_off_by_default(self):
+        qtree = QuadTree((0, 0, 100, 100), 4, 8)
+        self.assertIsNone(qtree.instrumentation)
+        qtree.add(0, (1, 1))
+        self.assertEqual(len(qtree.nearest_neighbors((0, 0))), 1)
+
+    def test_counts(self):
+        calls = []
+        qtree = QuadTree((0, 0, 100, 100), 4, 8)
+        qtree.instrumentation = Instrumentation(callback=calls.append)
+        qtree.add_many(range(100), [(i, (i * 7) % 100) for i in range(100)])
+        qtree.query((10, 10, 20, 20))
+        qtree.nearest_neighbors((50, 50), number_of_neighbors=3)
+        for i in range(100):
+            qtree.delete(i)
+
+        self.assertEqual([stats.method for stats in calls[:3]], ["add_many", "query", "nearest_neighbors"])
+        add_many, query, nearest = calls[:3]
+        self.assertEqual(add_many.splits, qtree.split_count)
+        self.assertGreater(query.nodes_visited, 0)
+        self.assertGreater(query.nodes_pruned, 0)
+        self.assertGreater(query.elements_filtered, 0)
+        self.assertGreaterEqual(nearest.distance_computations, 3)
+
+        summary = qtree.instrumentation.summary()
+        self.assertEqual(summary["delete"]["calls"], 100)
+        self.assertEqual(summary["delete"]["merges"], qtree.merge_count)
+        self.assertEqual(sum(count for _, count in qtree.instrumentation.latency_histogram("delete")), 100)
+
+        qtree.instrumentation.reset()
+        self.assertEqual(qtree.instrumentation.summary(), {})
+
+    def test_generators(self):
+        qtree = QuadTree.from_points([(i, (i * 7) % 100) for i in range(100)], bbox=(0, 0, 100, 100), max_elements=4)
+        other = QuadTree.from_points([(i, (i * 3) % 100) for i in range(100)], bbox=(0, 0, 100, 100))
+        qtree.instrumentation = Instrumentation()
+
+        join = qtree.join(other, 2)
+        self.assertEqual(qtree.instrumentation.summary(), {})
+        pairs = list(join)
+        self.assertEqual(len(list(qtree.pairs_within(3))), len(qtree.pairs_within_array(3)) // 2)
+
+        # Queries made while iterating are counted on their own
+        for element in qtree.iter_query((0, 0, 50, 50)):
+            qtree.query((element.point[0], element.point[1], 100, 100))
+            break
+
+        summary = qtree.instrumentation.summary()
+        for method in ("join", "pairs_within", "pairs_within_array", "iter_query"):
+            self.assertEqual(summary[method]["calls"], 1)
+            self.assertGreater(summary[method]["nodes_visited"], 0)
+        self.assertGreaterEqual(summary["join"]["distance_computations"], len(pairs))
+        self.assertEqual(summary["query"]["calls"], 1)
+        self.assertIsNone(qtree.instrumentation.current())
+
+
+class StatsAndAutotune(unittest.TestCase):
+    def test_stats(self):
+        qtree = QuadTree((0, 0, 100, 100), 4, 1)
+        for i, point in enumerate([(10, 10), (20, 20), (30, 30), (40, 40), (45, 45), (90, 90)]):
+            qtree.add(i, point)
+        stats = qtree.stats()
+        self.assertEqual(stats["depth_histogram"], [1, 4])
+        self.assertEqual(stats["leaf_occupancy"], [2, 1, 0, 0, 0, 1])
+        self.assertEqual(stats["empty_leaves"], 2)
+        self.assertEqual(stats["nodes_at_max_depth"], 4)
+        self.assertEqual((stats["nodes"], stats["leaves"], stats["elements"]), (5, 4, 6))
+
+    def test_autotune(self):
+        random.seed(3)
+        qtree = QuadTree((0, 0, 100, 100), 2, 4)
+        for i in range(500):
+            qtree.add(i, (random.uniform(0, 100), random.uniform(0, 100)))
+        before = sorted(e.item for e in qtree.query((10, 10, 60, 40)))
+
+        queries = [(10, 10, 60, 40), (50, 50)]
+        result = qtree.autotune(queries, candidates=[(2, 4), (16, 6)], repeat=1, rebuild=True)
+        self.assertEqual(sorted((max_elements, max_depth) for max_elements, max_depth, _ in result["results"]),
+                         [(2, 4), (16, 6)])
+        self.assertEqual((qtree.max_elements, qtree.max_depth), (result["max_elements"], result["max_depth"]))
+        self.assertEqual(qtree.merge_threshold, qtree.max_elements)
+        self.assertEqual(sorted(e.item for e in qtree.query((10, 10, 60, 40))), before)
+
+    def test_autotune_snapshot(self):
+        qtree = QuadTree.from_points([(i % 20, i // 20) for i in range(200)], bbox=(0, 0, 20, 10))
+        snapshot = qtree.snapshot()
+        self.assertRaises(TypeError, snapshot.autotune, [(5, 5)], candidates=[(2, 4)], repeat=1, rebuild=True)
+        self.assertEqual(len(snapshot.autotune([(5, 5)], candidates=[(2, 4)], repeat=1)["results"]), 1)
+        for handle in range(200):
+            qtree.delete(handle=handle)
+        self.assertEqual(qtree.query((0, 0, 20, 10)), [])
+        self.assertEqual(len(snapshot.query((0, 0, 20, 10))), 200)
+
+
+class CountAndAggregate(unittest.TestCase):
+    class Thing:
+        def __init__(self, mass):
+            self.mass = mass
+
+    def setUp(self):
+        random.seed(9)
+        self.qtree = QuadTree((-500, -500, 500, 500), 4, 10)
+        self.things = {}
+        for _ in range(1000):
+            self.add(self.Thing(random.randint(1, 100)), (random.uniform(-500, 500), random.uniform(-500, 500)))
+
+    def add(self, thing, point):
+        self.things[thing] = point
+        self.qtree.add(thing, point)
+
+    def check(self):
+        stack = [self.qtree.root]
+        while stack:
+            node = stack.pop()
+            under = []
+            node.get_elements(under)
+            self.assertEqual(node.count, len(under))
+            stack.extend(node.children)
+
+        for _ in range(20):
+            minx, miny = random.uniform(-600, 400), random.uniform(-600, 400)
+            bbox = (minx, miny, minx + random.uniform(0, 600), miny + random.uniform(0, 600))
+            masses = [thing.mass for thing, (x, y) in self.things.items()
+                      if bbox[0] <= x < bbox[2] and bbox[1] <= y < bbox[3]]
+            self.assertEqual(self.qtree.count(bbox), len(masses))
+            expected = {"count": len(masses), "sum": sum(masses), "min": min(masses, default=None),
+                        "max": max(masses, default=None)}
+            self.assertEqual(self.qtree.aggregate(bbox, "mass"), expected)
+
+    def test_after_changes(self):
+        self.check()
+        for thing in random.sample(list(self.things), 300):
+            del self.things[thing]
+            self.qtree.delete(thing)
+        self.check()
+        for thing in random.sample(list(self.things), 300):
+            self.things[thing] = (random.uniform(-500, 500), random.uniform(-500, 500))
+            self.qtree.move(thing, self.things[thing])
+        for _ in range(200):
+            self.add(self.Thing(random.randint(1, 100)), (random.uniform(-500, 500), random.uniform(-500, 500)))
+        self.check()
+        things = list(self.things)
+        for thing in things:
+            self.things[thing] = (random.uniform(-500, 500), random.uniform(-500, 500))
+        self.qtree.update_many(things, [self.things[thing] for thing in things])
+        self.check()
+
+    def test_clear_summaries(self):
+        self.assertEqual(self.qtree.aggregate((-500, -500, 500, 500), "mass")["count"], 1000)
+        for thing in self.things:
+            thing.mass = 1
+        self.qtree.clear_summaries()
+        self.check()
+
+
+class IterQuery(unittest.TestCase):
+    def setUp(self):
+        random.seed(10)
+        self.qtree = QuadTree((-500, -500, 500, 500), 4, 10)
+        for i in range(2000):
+            self.qtree.add(i, (random.uniform(-500, 500), random.uniform(-500, 500)))
+
+    def test_matches_query(self):
+        for bbox in [(-500, -500, 500, 500), (-100, -300, 250, 20), (-1, -1, 1, 1)]:
+            self.assertEqual(sorted(e.item for e in self.qtree.iter_query(bbox)),
+                             sorted(e.item for e in self.qtree.query(bbox)))
+
+    def test_early_termination(self):
+        calls = []
+        self.qtree.instrumentation = Instrumentation(callback=calls.append)
+
+        iterator = self.qtree.iter_query((-500, -500, 500, 500))
+        first = next(iterator)
+        self.assertIn(first.item, range(2000))
+        iterator.close()
+        self.assertEqual(len(list(self.qtree.iter_query((-500, -500, 500, 500)))), 2000)
+
+        # Stopping after the first element only walks down to the first leaf
+        stopped, full = calls
+        self.assertLessEqual(stopped.nodes_visited, 11)
+        self.assertLess(stopped.nodes_visited * 10, full.nodes_visited)
+
+    def test_any_in(self):
+        self.assertTrue(self.qtree.any_in((-500, -500, 500, 500)))
+        self.assertTrue(self.qtree.any_in((-100, -100, 100, 100)))
+        self.assertFalse(self.qtree.any_in((600, 600, 700, 700)))
+        self.qtree.add("lonely", (550, 550))
+        self.assertTrue(self.qtree.any_in((549, 549, 551, 551)))
+
+
+class QueryRadius(unittest.TestCase):
+    def test_matches_brute_force(self):
+        random.seed(11)
+        points = [(random.randint(-500, 500), random.randint(-500, 500)) for _ in range(3000)]
+        qtree = QuadTree.from_points(points, bbox=(-500, -500, 500, 500), max_elements=4)
+        for _ in range(30):
+            center = (random.randint(-550, 550), random.randint(-550, 550))
+            radius = random.randint(0, 300)
+            expected = sorted(((x - center[0]) ** 2 + (y - center[1]) ** 2, i) for i, (x, y) in enumerate(points)
+                              if (x - center[0]) ** 2 + (y - center[1]) ** 2 <= radius ** 2)
+            self.assertEqual(sorted(e.item for e in qtree.query_radius(center, radius)),
+                             sorted(i for _, i in expected))
+
+            found = qtree.query_radius(center, radius, sort=True, return_distances=True)
+            self.assertEqual([distance for _, distance in found], [math.sqrt(distance_sq) for distance_sq, _ in expected])
+
+            sorted_elements = qtree.query_radius(center, radius, sort=True)
+            self.assertEqual(sorted_elements, [e for e, _ in found])
+
+    def test_outside_of_bbox(self):
+        qtree = QuadTree((0, 0, 100, 100), 1, 5)
+        for i in range(20):
+            qtree.add(i, (i * 5, i * 5))
+        qtree.add("outside", (150, 50))
+        self.assertEqual([e.item for e in qtree.query((149, 49, 151, 51))], ["outside"])
+        self.assertEqual([e.item for e in qtree.query_radius((150, 50), 2)], ["outside"])
+        self.assertEqual([e.item for e in qtree.query_radius((150, 50), 2, sort=True)], ["outside"])
+
+
+class PairsWithin(unittest.TestCase):
+    def test_matches_brute_force(self):
+        random.seed(12)
+        points = [(random.randint(-500, 500), random.randint(-500, 500)) for _ in range(800)]
+        qtree = QuadTree.from_points(points, bbox=(-500, -500, 500, 500), max_elements=4)
+        for distance in (0, 10, 45):
+            expected = set()
+            for i, (x, y) in enumerate(points):
+                for j in range(i + 1, len(points)):
+                    if (x - points[j][0]) ** 2 + (y - points[j][1]) ** 2 <= distance ** 2:
+                        expected.add((i, j))
+
+            found = [tuple(sorted((a.item, b.item))) for a, b in qtree.pairs_within(distance)]
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(set(found), expected)
+
+            pairs = qtree.pairs_within_array(distance)
+            self.assertEqual(pairs.itemsize, 8)
+            handle_pairs = {tuple(sorted(pairs[i:i + 2])) for i in range(0, len(pairs), 2)}
+            self.assertEqual(handle_pairs, expected)
+
+
+class JoinTrees(unittest.TestCase):
+    def setUp(self):
+        random.seed(13)
+        self.vehicles = [(random.uniform(-500, 500), random.uniform(-500, 500)) for _ in range(1000)]
+        self.depots = [(random.uniform(-300, 700), random.uniform(-200, 200)) for _ in range(150)]
+        self.vehicle_tree = QuadTree.from_points(self.vehicles, bbox=(-500, -500, 500, 500), max_elements=4)
+        self.depot_tree = QuadTree.from_points(self.depots, max_elements=2, max_depth=6)
+
+    def distance(self, vehicle, depot):
+        return math.dist(self.vehicles[vehicle], self.depots[depot])
+
+    def test_join(self):
+        for max_distance in (0, 15, 60):
+            found = [(a.item, b.item) for a, b in self.vehicle_tree.join(self.depot_tree, max_distance)]
+            expected = {(i, j) for i in range(len(self.vehicles)) for j in range(len(self.depots))
+                        if self.distance(i, j) <= max_distance}
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(set(found), expected)
+
+    def test_nearest_in(self):
+        found = self.vehicle_tree.nearest_in(self.depot_tree, return_distances=True)
+        self.assertEqual(len(found), len(self.vehicles))
+        for vehicle, depot, distance in found:
+            self.assertAlmostEqual(distance, min(self.distance(vehicle.item, j) for j in range(len(self.depots))))
+            self.assertAlmostEqual(distance, self.distance(vehicle.item, depot.item))
+
+    def test_nearest_in_max_distance(self):
+        found = self.vehicle_tree.nearest_in(self.depot_tree, max_distance=20)
+        expected = [i for i in range(len(self.vehicles))
+                    if min(self.distance(i, j) for j in range(len(self.depots))) < 20]
+        self.assertEqual(sorted(vehicle.item for vehicle, _ in found), expected)
+
+    def test_outside_of_bbox(self):
+        # Both trees hold (200, 50), which is outside of the first tree's bbox and inside the second's
+        a = QuadTree((0, 0, 100, 100), 2)
+        a.add_many(["far", 1, 2, 3], [(200, 50), (10, 10), (11, 10), (10, 11)])
+        b = QuadTree((150, 0, 250, 100), 2)
+        b.add_many(["far", 4, 5, 6, 7, 8, 9], [(200, 50)] + [(155 + i, 5) for i in range(6)])
+
+        self.assertEqual([(e.item, other.item) for e, other in a.join(b, 1)], [("far", "far")])
+        self.assertEqual([(e.item, other.item) for e, other in b.join(a, 1)], [("far", "far")])
+        nearest = {e.item: (other.item, distance) for e, other, distance in a.nearest_in(b, return_distances=True)}
+        self.assertEqual(nearest["far"], ("far", 0))
+
+        a.add("near far", (199.5, 50))
+        pairs = {tuple(sorted((e.item, other.item), key=str)) for e, other in a.pairs_within(0.5)}
+        self.assertEqual(pairs, {("far", "near far")})
+
+
+class LooseTree(unittest.TestCase):
+    def random_box(self, max_size):
+        x, y = random.uniform(-500, 500), random.uniform(-500, 500)
+        return x, y, x + random.uniform(0, max_size), y + random.uniform(0, max_size)
+
+    def expected(self, boxes, query):
+        return sorted(i for i, box in boxes.items()
+                      if box[0] <= query[2] and query[0] <= box[2] and box[1] <= query[3] and query[1] <= box[3])
+
+    def test_matches_brute_force(self):
+        random.seed(14)
+        qtree = LooseQuadTree((-500, -500, 500, 500), 4, 10)
+        boxes = {}
+        handles = {}
+        for i in range(1500):
+            boxes[i] = self.random_box(random.choice([1, 10, 100, 600]))
+            handles[i] = qtree.add(i, boxes[i])
+
+        for i in random.sample(range(1500), 500):
+            if i % 2:
+                qtree.delete(i)
+            else:
+                qtree.delete(handle=handles[i])
+            del boxes[i]
+
+        for _ in range(50):
+            query = self.random_box(200)
+            found = [e.item for e in qtree.query(query)]
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(sorted(found), self.expected(boxes, query))
+
+        for element in qtree.get_all_elements():
+            self.assertIs(element.node.elements[element.index], element)
+
+    def test_duplicate_items(self):
+        qtree = LooseQuadTree((0, 0, 100, 100), 1, 5)
+        first = qtree.add("a", (10, 10, 20, 20))
+        second = qtree.add("a", (60, 60, 90, 90))
+        qtree.delete(handle=first)
+        qtree.delete(handle=second)
+        self.assertEqual(qtree.get_all_elements(), [])
+        self.assertEqual(qtree.item_to_bbox_map, {})
+
+        qtree.add("b", (10, 10, 20, 20))
+        qtree.add("b", (60, 60, 90, 90))
+        qtree.delete("b")
+        self.assertRaises(KeyError, qtree.delete, "b")
+        self.assertEqual([e.bbox for e in qtree.get_all_elements()], [(10, 10, 20, 20)])
+
+    def test_each_item_stored_once(self):
+        qtree = LooseQuadTree((0, 0, 100, 100), 1, 5)
+        qtree.add("big", (10, 10, 90, 90))
+        qtree.add("small", (10, 10, 11, 11))
+        qtree.add("edge", (49, 49, 51, 51))
+        self.assertEqual(sorted(e.item for e in qtree.query((0, 0, 100, 100))), ["big", "edge", "small"])
+        self.assertEqual(sorted(e.item for e in qtree.query((50, 50, 50, 50))), ["big", "edge"])
+        self.assertEqual([e.item for e in qtree.root.elements], ["big"])
+        for item in ("big", "small", "edge"):
+            qtree.delete(item)
+        self.assertEqual(qtree.root.children, [])
+        self.assertEqual(qtree.query((0, 0, 100, 100)), [])
+
+
+class LinearTree(unittest.TestCase):
+    def random_point(self):
+        # Some points on the grid lines and outside of the bbox
+        return (random.choice([random.uniform(-10, 110), float(random.randint(0, 100))]),
+                random.choice([random.uniform(-10, 110), float(random.randint(0, 100))]))
+
+    def assert_same(self, linear, qtree):
+        for _ in range(50):
+            x1, x2 = sorted(self.random_point()[0] for _ in range(2))
+            y1, y2 = sorted(self.random_point()[1] for _ in range(2))
+            self.assertEqual(sorted(e.item for e in linear.query((x1, y1, x2, y2))),
+                             sorted(e.item for e in qtree.query((x1, y1, x2, y2))))
+
+            # Compared to brute force since QuadTree can miss points outside of its bbox
+            point = self.random_point()
+            self.assertEqual([round(d, 9) for _, d in linear.nearest_neighbors(point, number_of_neighbors=5,
+                                                                              return_distances=True)],
+                             sorted(round(math.dist(point, e.point), 9) for e in qtree.get_all_elements())[:5])
+
+    def test_matches_quadtree(self):
+        random.seed(15)
+        for max_elements, max_depth in [(1, 0), (4, 3), (10, 10), (64, 16)]:
+            qtree = QuadTree((0, 0, 100, 100), 4, 10)
+            linear = LinearQuadTree((0, 0, 100, 100), max_elements, max_depth)
+            handles = {}
+            for i in range(600):
+                point = self.random_point()
+                qtree.add(i, point)
+                handles[i] = linear.add(i, point)
+
+            for i in range(0, 600, 3):
+                qtree.delete(i)
+                if i % 2:
+                    linear.delete(i)
+                else:
+                    linear.delete(handle=handles[i])
+            for i in range(1, 600, 3):
+                point = self.random_point() if i % 2 else (qtree.item_to_point_map[i][0] + 0.5,
+                                                           qtree.item_to_point_map[i][1])
+                qtree.move(i, point)
+                linear.move(handle=handles[i], new_point=point)
+
+            self.assertEqual(list(linear.keys), sorted(linear.keys))
+            self.assertEqual(list(linear.keys), [linear.key(e.point) for e in linear.elements])
+            self.assert_same(linear, qtree)
+
+    def test_from_points(self):
+        random.seed(16)
+        points = [self.random_point() for _ in range(500)]
+        linear = LinearQuadTree.from_points(points, bbox=(0, 0, 100, 100), max_elements=8)
+        self.assertEqual(sorted(e.handle for e in linear.get_all_elements()), list(range(500)))
+        self.assert_same(linear, QuadTree.from_points(points, bbox=(0, 0, 100, 100)))
+
+        linear.add_many(range(500, 600), points[:100])
+        self.assertEqual(list(linear.keys), sorted(linear.keys))
+        self.assertEqual(len(linear.query((0, 0, 100, 100))),
+                         2 * sum(1 for x, y in points[:100] if 0 <= x < 100 and 0 <= y < 100) +
+                         sum(1 for x, y in points[100:] if 0 <= x < 100 and 0 <= y < 100))
+
+    def test_untracked(self):
+        linear = LinearQuadTree((0, 0, 10, 10), track_items=False)
+        handle = linear.add([1], (5, 5))
+        self.assertRaises(ValueError, linear.delete, [1])
+        linear.delete(handle=handle)
+        self.assertEqual(linear.query((0, 0, 10, 10)), [])
+
+
+class FrozenTree(unittest.TestCase):
+    def setUp(self):
+        self.qtree = QuadTree((0, 0, 100, 100), 3, 8)
+        for i in range(200):
+            self.qtree.add("item" + str(i), ((i * 37) % 101, (i * 53) % 103))
+        for i in range(0, 200, 9):
+            self.qtree.delete("item" + str(i))
+
+    def assert_same(self, frozen):
+        for bbox in [(0, 0, 100, 100), (10, 20, 55, 50), (-5, -5, 0.5, 200), (50, 50, 50.5, 50.5)]:
+            expected = sorted((e.item, e.point, e.handle) for e in self.qtree.query(bbox))
+            self.assertEqual(sorted((e.item, e.point, e.handle) for e in frozen.query(bbox)), expected)
+        for point in [(0, 0), (33.3, 71), (150, -20)]:
+            self.assertEqual(
+                [(e.item, d) for e, d in frozen.nearest_neighbors(point, number_of_neighbors=4, return_distances=True)],
+                [(e.item, d) for e, d in self.qtree.nearest_neighbors(point, number_of_neighbors=4,
+                                                                       return_distances=True)])
+
+    def test_freeze(self):
+        self.assert_same(self.qtree.freeze())
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tree.qt")
+            self.qtree.save(path)
+            for mmap in (True, False):
+                with QuadTree.load(path, mmap=mmap) as frozen:
+                    self.assert_same(frozen)
+
+    def test_shared_memory(self):
+        shared = self.qtree.freeze().to_shared_memory()
+        try:
+            with FrozenQuadTree.attach(shared.name) as attached:
+                self.assert_same(attached)
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def test_attach_from_another_process(self):
+        shared = self.qtree.freeze().to_shared_memory()
+        try:
+            # The block has to outlive a process that attached to it and exited
+            code = ("import sys\n"
+                    "from pyquadtree import FrozenQuadTree\n"
+                    "with FrozenQuadTree.attach(sys.argv[1]) as attached:\n"
+                    "    print(len(attached.query((0, 0, 100, 100))))\n")
+            result = subprocess.run([sys.executable, "-c", code, shared.name], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+            self.assertEqual(int(result.stdout), len(self.qtree.query((0, 0, 100, 100))))
+            self.assertNotIn("leaked", result.stderr)
+
+            self.assert_same(shared)
+            with FrozenQuadTree.attach(shared.name) as attached:
+                self.assert_same(attached)
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def test_outside_of_bbox(self):
+        qtree = QuadTree((0, 0, 100, 100), 2)
+        for i, point in enumerate([(10, 10), (100, 50), (200, 60), (50, 50), (20, 20)]):
+            qtree.add(i, point)
+        frozen = qtree.freeze()
+        self.assertEqual([(e.item, d) for e, d in frozen.nearest_neighbors((200, 50), return_distances=True)],
+                         [(2, 10)])
+        self.assertEqual([e.item for e in frozen.nearest_neighbors((95, 50), number_of_neighbors=2)], [1, 3])
+
+    def test_not_a_tree(self):
+        self.assertRaises(ValueError, FrozenQuadTree, bytes(64))
+
+
+class ParallelQueries(unittest.TestCase):
+    def test_matches_serial(self):
+        random.seed(7)
+        qtree = QuadTree.from_points([(random.uniform(0, 100), random.uniform(0, 100)) for _ in range(2000)])
+        bboxes = [(x, y, x + 15, y + 10) for x, y in [(random.uniform(-10, 100), random.uniform(-10, 100))
+                                                      for _ in range(200)]]
+        points = [(random.uniform(-10, 110), random.uniform(-10, 110)) for _ in range(200)]
+
+        with ParallelQueryExecutor(qtree, processes=2, chunk_size=16) as executor:
+            found = executor.query_many(bboxes)
+            found_handles = executor.query_many(bboxes, handles=True)
+            neighbors = executor.nearest_neighbors_many(points, number_of_neighbors=3, return_distances=True)
+
+        for bbox, elements, handles in zip(bboxes, found, found_handles):
+            expected = sorted(e.handle for e in qtree.query(bbox))
+            self.assertEqual(sorted(e.handle for e in elements), expected)
+            self.assertEqual(sorted(handles), expected)
+        for point, nearest in zip(points, neighbors):
+            expected = qtree.nearest_neighbors(point, number_of_neighbors=3, return_distances=True)
+            self.assertEqual([(e.handle, d) for e, d in nearest], [(e.handle, d) for e, d in expected])
+
+
+class Benchmarks(unittest.TestCase):
+    def test_workloads_are_seeded(self):
+        for make_workload in WORKLOADS.values():
+            first, second = make_workload(200, 1), make_workload(200, 1)
+            self.assertEqual((first.points, first.queries, first.moves), (second.points, second.queries, second.moves))
+            self.assertNotEqual(first.points, make_workload(200, 2).points)
+
+    def test_compare(self):
+        workload = WORKLOADS["uniform"](200, 0)
+        results = {"workloads": {"uniform": {"operations": run_workload(workload, repeat=1),
+                                             "memory_bytes_per_point": 100}}}
+        self.assertEqual(compare(results, results), [])
+
+        slower = json.loads(json.dumps(results))
+        slower["workloads"]["uniform"]["operations"]["query"]["ops_per_sec"] /= 2
+        slower["workloads"]["uniform"]["memory_bytes_per_point"] = 150
+        self.assertEqual([(name, metric) for name, metric, _, _ in compare(slower, results)],
+                         [("uniform", "query ops/sec"), ("uniform", "memory bytes/point")])
+
+    def test_linear_engine(self):
+        operations = run_workload(WORKLOADS["moving_objects"](200, 0), LinearQuadTree, repeat=1)
+        self.assertTrue(all(timing["ops_per_sec"] for timing in operations.values()))
+
+    def test_engine_defaults(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            for engine, max_elements in (("quadtree", 10), ("linear", 64)):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    benchmarks_main(["--engine", engine, "--size", "200", "--repeat", "1",
+                                     "--workloads", "large_queries", "--output", path])
+                with open(path) as file:
+                    self.assertEqual(json.load(file)["settings"]["max_elements"], max_elements)
+
+
 if __name__ == '__main__':
     unittest.main()